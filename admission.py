@@ -0,0 +1,170 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import Counter
+
+# Lower values are admitted first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+
+class RateLimited(Exception):
+    """The request was not admitted; retry after `retry_after` seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"rate limited ({reason}), retry after {retry_after:.2f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `burst`; a rate of 0 means unlimited
+
+    Not thread-safe on its own; AdmissionController guards every bucket.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Take a token and return 0, or return the seconds until one is available"""
+        if self.rate <= 0:
+            return 0
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + 1)
+
+    def full(self, now):
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class AdmissionController:
+    """Per-user and global token buckets with a bounded priority wait queue
+
+    A user over their own rate is rejected at once. Requests that find the
+    global bucket empty wait in a queue ordered by priority, then arrival, for
+    at most `max_wait` seconds. When the queue is full, or the expected wait
+    would exceed `max_wait`, they are rejected straight away instead.
+    """
+
+    def __init__(self, user_rate, user_burst, global_rate, global_burst, max_queue=50, max_wait=2.0):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._users = {}
+        self._waiters = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._last_prune = time.monotonic()
+        self.admitted = Counter()
+        self.rejected = Counter()
+        self.queued = 0
+        self.max_queue_depth = 0
+        self.wait_seconds = 0.0
+
+    def _user_bucket(self, user_id, now):
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst)
+        # Buckets that have refilled completely are the same as new ones
+        if now - self._last_prune > 60:
+            self._last_prune = now
+            for key in [k for k, b in self._users.items() if k != user_id and b.full(now)]:
+                del self._users[key]
+        return bucket
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        raise RateLimited(reason, retry_after)
+
+    def _expected_wait(self, priority):
+        # Everyone queued at this priority or better goes first
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority)
+        rate = self.global_bucket.rate
+        return (ahead + 1) / rate if rate > 0 else 0
+
+    def admit(self, user_id, priority=INTERACTIVE):
+        """Return once the request may proceed, or raise RateLimited"""
+        with self._cond:
+            now = time.monotonic()
+            user_bucket = self._user_bucket(user_id, now)
+            wait = user_bucket.take(now)
+            if wait:
+                self._reject("user", wait)
+
+            if not self._waiters and not self.global_bucket.take(now):
+                self.admitted[PRIORITY_NAMES[priority]] += 1
+                return
+
+            expected = self._expected_wait(priority)
+            if len(self._waiters) >= self.max_queue or expected > self.max_wait:
+                user_bucket.refund()
+                self._reject("queue_full", expected)
+
+            entry = [priority, next(self._order)]
+            heapq.heappush(self._waiters, entry)
+            self.queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiters))
+            start = now
+            deadline = now + self.max_wait
+            try:
+                while True:
+                    at_head = self._waiters[0] is entry
+                    wait = self.global_bucket.take(now) if at_head else self.max_wait
+                    if at_head and not wait:
+                        heapq.heappop(self._waiters)
+                        self.admitted[PRIORITY_NAMES[priority]] += 1
+                        self.wait_seconds += now - start
+                        return
+                    if now >= deadline:
+                        self._waiters.remove(entry)
+                        heapq.heapify(self._waiters)
+                        user_bucket.refund()
+                        self._reject("timeout", self._expected_wait(priority))
+                    self._cond.wait(min(wait, deadline - now))
+                    now = time.monotonic()
+            finally:
+                # The next in line may be able to go now
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            admitted = sum(self.admitted.values())
+            return {
+                "queue_depth": len(self._waiters),
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": dict(self.admitted),
+                "rejected": dict(self.rejected),
+                "queued": self.queued,
+                "mean_wait_ms": round(self.wait_seconds / self.queued * 1000, 2) if self.queued else 0.0,
+                "rejection_rate": round(sum(self.rejected.values()) / max(1, admitted + sum(self.rejected.values())), 4),
+                "tracked_users": len(self._users),
+                "limits": {
+                    "user_rate": self.user_rate,
+                    "user_burst": self.user_burst,
+                    "global_rate": self.global_bucket.rate,
+                    "global_burst": self.global_bucket.burst,
+                    "max_queue": self.max_queue,
+                    "max_wait": self.max_wait
+                }
+            }
@@ -0,0 +1,157 @@
+import threading
+import time
+import warnings
+
+import numpy as np
+
+PERCENTILES = [25, 50, 75, 90]
+
+
+class CohortSnapshot:
+    """Columnar (NumPy) view of every user's progress
+
+    One row per (user, subject, topic) with integer codes for the user, subject
+    and topic, so cohort statistics reduce to bincounts and array reductions.
+    """
+
+    def __init__(self, users, rows):
+        self.built_at = time.time()
+        self.user_ids = np.array([user_id for user_id, _ in users], dtype=object)
+        self.education_levels = np.array([level for _, level in users], dtype=object)
+        user_index = {user_id: i for i, (user_id, _) in enumerate(users)}
+        rows = [row for row in rows if row[0] in user_index]
+
+        subject_index = {}
+        topic_index = {}
+        for _, subject, topic, _, _ in rows:
+            subject_index.setdefault(subject, len(subject_index))
+            topic_index.setdefault((subject, topic), len(topic_index))
+        self.subjects = list(subject_index)
+        self.topics = list(topic_index)
+
+        self.row_user = np.fromiter((user_index[r[0]] for r in rows), dtype=np.int64, count=len(rows))
+        self.row_subject = np.fromiter((subject_index[r[1]] for r in rows), dtype=np.int64, count=len(rows))
+        self.row_topic = np.fromiter((topic_index[(r[1], r[2])] for r in rows), dtype=np.int64, count=len(rows))
+        self.interactions = np.fromiter((r[3] or 0 for r in rows), dtype=np.int64, count=len(rows))
+        self.last_day = np.array([r[4][:10] if r[4] else "NaT" for r in rows], dtype="datetime64[D]")
+
+        # Users x subjects interaction matrix
+        self.matrix = np.zeros((len(self.user_ids), len(self.subjects)), dtype=np.int64)
+        np.add.at(self.matrix, (self.row_user, self.row_subject), self.interactions)
+
+    @property
+    def size(self):
+        return len(self.user_ids)
+
+    def subject_stats(self, bins=10):
+        """Per-subject percentiles and histograms of interactions among active users"""
+        if not self.subjects:
+            return {}, []
+        active = self.matrix > 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            percentiles = np.nanpercentile(np.where(active, self.matrix, np.nan), PERCENTILES, axis=0)
+
+        values = self.matrix[active]
+        edges = np.histogram_bin_edges(values if values.size else [0, 1], bins=bins)
+        bucket = np.clip(np.searchsorted(edges, self.matrix, side="right") - 1, 0, bins - 1)
+        histograms = np.zeros((len(self.subjects), bins), dtype=np.int64)
+        subject_of_cell = np.broadcast_to(np.arange(len(self.subjects)), self.matrix.shape)
+        np.add.at(histograms, (subject_of_cell[active], bucket[active]), 1)
+
+        active_users = active.sum(axis=0)
+        totals = self.matrix.sum(axis=0)
+        progress = np.minimum(100, self.matrix * 5).mean(axis=0) if self.size else np.zeros(len(self.subjects))
+        stats = {}
+        for i, subject in enumerate(self.subjects):
+            stats[subject] = {
+                "active_users": int(active_users[i]),
+                "total_interactions": int(totals[i]),
+                "average_progress": round(float(progress[i]), 2),
+                "percentiles": {
+                    f"p{p}": (None if np.isnan(percentiles[j, i]) else float(percentiles[j, i]))
+                    for j, p in enumerate(PERCENTILES)
+                },
+                "histogram": histograms[i].tolist(),
+            }
+        return stats, edges.tolist()
+
+    def top_topics(self, top=10):
+        """Topics ranked by interactions, with the share of the cohort that touched them"""
+        if not self.topics:
+            return []
+        interactions = np.bincount(self.row_topic, weights=self.interactions, minlength=len(self.topics))
+        learners = np.bincount(self.row_topic, minlength=len(self.topics))
+        order = np.argsort(-interactions, kind="stable")[:top]
+        return [
+            {
+                "subject": self.topics[i][0],
+                "topic": self.topics[i][1],
+                "interactions": int(interactions[i]),
+                "learners": int(learners[i]),
+                "coverage": round(float(learners[i]) / self.size, 4) if self.size else 0.0,
+            }
+            for i in order
+        ]
+
+    def activity_by_day(self):
+        """Topics and interactions grouped by the day each topic was last studied"""
+        known = ~np.isnat(self.last_day)
+        days, inverse = np.unique(self.last_day[known], return_inverse=True)
+        topics = np.bincount(inverse, minlength=len(days))
+        interactions = np.bincount(inverse, weights=self.interactions[known], minlength=len(days))
+        return [
+            {"date": str(day), "topics": int(t), "interactions": int(n)}
+            for day, t, n in zip(days, topics, interactions)
+        ]
+
+    def students(self, offset=0, limit=50):
+        """One page of per-student totals, ordered by user id"""
+        order = np.argsort(self.user_ids.astype(str), kind="stable")[offset:offset + limit]
+        totals = self.matrix.sum(axis=1)
+        topics = np.bincount(self.row_user, minlength=self.size)
+        return [
+            {
+                "user_id": self.user_ids[i],
+                "education_level": self.education_levels[i],
+                "total_interactions": int(totals[i]),
+                "topics_touched": int(topics[i]),
+            }
+            for i in order
+        ]
+
+    def report(self, offset=0, limit=50, top=10, bins=10):
+        subjects, bin_edges = self.subject_stats(bins=bins)
+        return {
+            "users": self.size,
+            "built_at": self.built_at,
+            "subjects": subjects,
+            "histogram_bin_edges": bin_edges,
+            "top_topics": self.top_topics(top=top),
+            "activity_by_day": self.activity_by_day(),
+            "students": self.students(offset=offset, limit=limit),
+            "offset": offset,
+            "limit": limit,
+        }
+
+
+class CohortAnalytics:
+    """Builds cohort snapshots from a store and reuses them for `ttl` seconds"""
+
+    def __init__(self, store, ttl=30):
+        self.store = store
+        self.ttl = ttl
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, education_level=None):
+        with self._lock:
+            snapshot = self._snapshots.get(education_level)
+            if snapshot is None or time.time() - snapshot.built_at > self.ttl:
+                users, rows = self.store.cohort_rows(education_level=education_level)
+                snapshot = self._snapshots[education_level] = CohortSnapshot(users, rows)
+            return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshots.clear()
@@ -1,112 +1,497 @@
 import requests
+import copy
 import json
 import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import replace
 from dotenv import load_dotenv
+import api_models as models
+from health import HealthCache
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from service import ApiResult, EventStream, dispatch
+from urllib3.util.retry import Retry
 
 # Load environment variables
 load_dotenv()
 
 # Base URL for the backend API
-BASE_URL = "http://localhost:5000"
+BASE_URL = os.getenv("TUTOR_API_URL", "http://localhost:5000")
+
+# (connect, read) timeouts in seconds per endpoint group
+DEFAULT_TIMEOUTS = {
+    "default": (3.05, 10),
+    "chat": (3.05, 60),
+    "stream": (3.05, 120),
+    "analytics": (3.05, 30),
+    "health": (0.5, 1.5)
+}
+
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+class StreamInterrupted(Exception):
+    """A streamed response broke off after its headers, so the backend already has the request"""
+
+def build_http_session(pool_size=10, retries=3, backoff=0.2):
+    """Keep-alive connection pool; only idempotent GETs are retried on failure"""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        status=retries,
+        backoff_factor=backoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    http = requests.Session()
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+class HTTPTransport:
+    """Sends requests to a backend server over a keep-alive connection pool"""
+    
+    def __init__(self, base_url=BASE_URL, http=None):
+        self.base_url = base_url
+        self.http = http or build_http_session()
+        # Small pool without retries for requests that must fail fast
+        self.http_once = build_http_session(pool_size=2, retries=0)
+    
+    def send(self, request, timeout=None):
+        http = self.http if request.retry else self.http_once
+        return http.request(
+            request.method,
+            f"{self.base_url}{request.path}",
+            params=request.params,
+            json=request.json,
+            headers=request.headers,
+            timeout=timeout
+        )
+    
+    @contextmanager
+    def stream(self, request, timeout=None):
+        """(status_code, events) for a server-sent events response"""
+        with self.http.request(
+            request.method,
+            f"{self.base_url}{request.path}",
+            params=request.params,
+            json=request.json,
+            headers=request.headers,
+            timeout=timeout,
+            stream=True
+        ) as response:
+            yield response.status_code, self._events(response)
+    
+    @staticmethod
+    def _events(response):
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = None
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):].strip())
+                if event == "done":
+                    data["done"] = True
+                yield data
+
+class InProcessResponse:
+    """The parts of a requests.Response the client reads, for in-process calls"""
+    
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = CaseInsensitiveDict(headers or {})
+    
+    def json(self):
+        return self.body
+
+class InProcessTransport:
+    """Calls the backend's route services directly in this process
+    
+    No sockets, HTTP parsing or JSON encoding: request bodies and responses are
+    passed as Python objects, so neither side may mutate them afterwards.
+    Timeouts do not apply.
+    """
+    
+    def __init__(self, app=None):
+        if app is None:
+            import backend
+            app = backend.app
+        self.app = app
+    
+    def _dispatch(self, request):
+        params = {k: str(v) for k, v in (request.params or {}).items() if v is not None}
+        try:
+            return dispatch(self.app, request.method, request.path, params, request.json, request.headers)
+        except Exception as e:
+            # What the HTTP server would answer for an unhandled error
+            print(f"In-process {request.method} {request.path} failed: {e}")
+            return ApiResult({"error": "Internal server error"}, 500)
+    
+    def send(self, request, timeout=None):
+        result = self._dispatch(request)
+        if isinstance(result, EventStream):
+            return InProcessResponse(200, list(self._events(result)), result.headers)
+        return InProcessResponse(result.status, result.body, result.headers)
+    
+    @contextmanager
+    def stream(self, request, timeout=None):
+        result = self._dispatch(request)
+        if isinstance(result, EventStream):
+            yield 200, self._events(result)
+        else:
+            yield result.status, iter(())
+    
+    @staticmethod
+    def _events(result):
+        for payload, event in result.events:
+            yield dict(payload, done=True) if event == "done" else payload
+
+def create_transport():
+    """The transport selected by TUTOR_TRANSPORT
+    
+    "inprocess" runs the backend inside this process; "http" (the default)
+    returns None, letting TutorAPIClient build its HTTP connection pool.
+    """
+    mode = os.getenv("TUTOR_TRANSPORT", "http").lower()
+    if mode == "inprocess":
+        return InProcessTransport()
+    if mode != "http":
+        raise ValueError(f"Unknown TUTOR_TRANSPORT: {mode}")
+    return None
+
+class LatencyStats:
+    """Thread-safe per-endpoint call latency statistics"""
+    
+    def __init__(self, window=512):
+        self.window = window
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            stats = self._calls.get(endpoint)
+            if stats is None:
+                stats = self._calls[endpoint] = {"count": 0, "errors": 0, "total": 0.0, "recent": deque(maxlen=self.window)}
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total"] += seconds
+            stats["recent"].append(seconds)
+    
+    def summary(self):
+        """Count, errors and mean/p50/p95/max latency in milliseconds per endpoint"""
+        with self._lock:
+            calls = {name: dict(stats, recent=sorted(stats["recent"])) for name, stats in self._calls.items()}
+        summary = {}
+        for name, stats in calls.items():
+            recent = stats["recent"]
+            summary[name] = {
+                "count": stats["count"],
+                "errors": stats["errors"],
+                "mean_ms": round(stats["total"] / stats["count"] * 1000, 2),
+                "p50_ms": round(recent[len(recent) // 2] * 1000, 2),
+                "p95_ms": round(recent[min(len(recent) - 1, int(len(recent) * 0.95))] * 1000, 2),
+                "max_ms": round(recent[-1] * 1000, 2)
+            }
+        return summary
+
+class ContentCache:
+    """Thread-safe cache of ETag-validated responses for near-static content"""
+    
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+    
+    @staticmethod
+    def key(request):
+        return request.path, tuple(sorted((request.params or {}).items()))
+    
+    def get(self, key):
+        with self._lock:
+            return self._entries.get(key)
+    
+    def store(self, key, body, etag, max_age):
+        with self._lock:
+            self._entries[key] = {"body": body, "etag": etag, "expires_at": time.time() + max_age}
+    
+    def refresh(self, key, max_age):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["expires_at"] = time.time() + max_age
+    
+    def count(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+    
+    def invalidate(self, path_prefix=None):
+        """Forget cached content, e.g. after it has been republished"""
+        with self._lock:
+            if path_prefix is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0].startswith(path_prefix)]:
+                    del self._entries[key]
+    
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits,
+                    "revalidations": self.revalidations, "misses": self.misses}
+
+def max_age(response):
+    match = MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+    return int(match.group(1)) if match else 0
 
 class TutorAPIClient:
-    """Client for interacting with the Tutor AI backend API"""
+    """Client for interacting with the Tutor AI backend API
     
-    def __init__(self, base_url=BASE_URL):
+    The transport (HTTP connection pool or in-process backend) and latency
+    stats are thread-safe and shared by every clone(); user_id/session_id are
+    per instance, so each Streamlit session should work on its own clone.
+    """
+    
+    def __init__(self, base_url=BASE_URL, pool_size=None, timeouts=None, retries=None, backoff=None,
+                 transport=None, stats=None, content_cache=None, health_cache=None):
         self.base_url = base_url
         self.session_id = None
         self.user_id = None
+        self._history = None
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.transport = transport or HTTPTransport(base_url, build_http_session(
+            pool_size=pool_size or int(os.getenv("TUTOR_API_POOL_SIZE", "10")),
+            retries=int(os.getenv("TUTOR_API_RETRIES", "3")) if retries is None else retries,
+            backoff=float(os.getenv("TUTOR_API_BACKOFF", "0.2")) if backoff is None else backoff
+        ))
+        self.stats = stats or LatencyStats()
+        self.content_cache = content_cache or ContentCache()
+        self.health_cache = health_cache or HealthCache(ttl=float(os.getenv("TUTOR_HEALTH_TTL", "5")))
+    
+    def clone(self):
+        """A client with its own user/session state sharing this one's transport and caches"""
+        return TutorAPIClient(self.base_url, timeouts=self.timeouts, transport=self.transport, stats=self.stats,
+                              content_cache=self.content_cache, health_cache=self.health_cache)
+    
+    def invalidate_content_cache(self, subject=None):
+        """Drop cached subjects/topics/content, or only one subject's, after republishing"""
+        if subject is None:
+            self.content_cache.invalidate()
+        else:
+            self.content_cache.invalidate(f"/api/subjects/{subject}/")
+            self.content_cache.invalidate(f"/api/content/{subject}/")
+            self.content_cache.invalidate("/api/subjects")
+    
+    def latency_stats(self):
+        """Per-endpoint latency statistics for calls made through this client's pool"""
+        return self.stats.summary()
+    
+    def _timeout(self, request):
+        return self.timeouts.get(request.timeout_group, self.timeouts["default"])
+    
+    def _request(self, request):
+        start = time.perf_counter()
+        error = True
+        try:
+            response = self.transport.send(request, timeout=self._timeout(request))
+            error = response.status_code >= 500
+            return response
+        finally:
+            self.stats.record(request.endpoint, time.perf_counter() - start, error=error)
+    
+    def _call(self, request):
+        if request.cacheable:
+            return self._call_cached(request)
+        response = self._request(request)
+        body = response.json() if response.status_code in models.BODY_STATUSES else None
+        return models.parse_response(request, response.status_code, body)
+    
+    def _call_cached(self, request):
+        # Serve from memory while fresh, otherwise revalidate with If-None-Match
+        key = self.content_cache.key(request)
+        entry = self.content_cache.get(key)
+        if entry is not None and entry["expires_at"] > time.time():
+            self.content_cache.count("hits")
+            return copy.deepcopy(entry["body"])
+        
+        if entry is not None:
+            request = replace(request, headers=dict(request.headers, **{"If-None-Match": entry["etag"]}))
+        response = self._request(request)
+        if response.status_code == 304 and entry is not None:
+            self.content_cache.count("revalidations")
+            self.content_cache.refresh(key, max_age(response))
+            return copy.deepcopy(entry["body"])
+        
+        self.content_cache.count("misses")
+        if response.status_code != 200:
+            return models.parse_response(request, response.status_code, None)
+        body = response.json()
+        if response.headers.get("ETag"):
+            self.content_cache.store(key, copy.deepcopy(body), response.headers["ETag"], max_age(response))
+        return body
     
     def create_user(self, name, education_level):
         """Create a new user profile"""
-        response = requests.post(
-            f"{self.base_url}/api/user",
-            json={
-                "name": name,
-                "education_level": education_level
-            }
-        )
-        if response.status_code == 200:
-            data = response.json()
+        data = self._call(models.create_user(name, education_level))
+        if "user_id" in data:
             self.user_id = data.get("user_id")
-            return data
-        return {"error": "Failed to create user", "status_code": response.status_code}
+        return data
     
     def get_user(self, user_id=None):
         """Get user profile and progress"""
         user_id = user_id or self.user_id
         if not user_id:
             return {"error": "No user ID provided"}
-        
-        response = requests.get(f"{self.base_url}/api/user/{user_id}")
-        if response.status_code == 200:
-            return response.json()
-        return {"error": "Failed to get user", "status_code": response.status_code}
+        return self._call(models.get_user(user_id))
     
     def get_subjects(self):
         """Get list of available subjects"""
-        response = requests.get(f"{self.base_url}/api/subjects")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        return self._call(models.get_subjects())
     
     def get_topics(self, subject):
         """Get topics for a specific subject"""
-        response = requests.get(f"{self.base_url}/api/subjects/{subject}/topics")
-        if response.status_code == 200:
-            return response.json()
-        return []
+        return self._call(models.get_topics(subject))
     
     def get_content(self, subject, topic, level="beginner"):
         """Get educational content for a subject and topic"""
-        response = requests.get(
-            f"{self.base_url}/api/content/{subject}/{topic}",
-            params={"level": level}
-        )
-        if response.status_code == 200:
-            return response.json()
-        return {"error": "Content not found"}
+        return self._call(models.get_content(subject, topic, level))
     
-    def send_message(self, message, subject, topic=""):
-        """Send a message to the AI tutor and get a response"""
+    def send_message(self, message, subject, topic="", fresh=False):
+        """Send a message to the AI tutor and get a response
+
+        Set fresh=True to bypass the backend response cache.
+        """
         if not self.session_id:
             # Create a new session if one doesn't exist
-            self.session_id = f"session_{os.urandom(4).hex()}"
+            self.session_id = models.new_session_id()
+        return self._call(models.send_message(self.user_id, self.session_id, message, subject, topic, fresh))
+    
+    def stream_message(self, message, subject, topic="", fresh=False):
+        """Send a message and yield the AI tutor's response as it is generated
+
+        Yields {"token": ...} events while the response streams, then a final
+        event with the same fields as send_message() plus "done": True. Raises
+        StreamInterrupted if the stream fails once the backend has answered;
+        failures before that raise the transport's own errors.
+        """
+        if not self.session_id:
+            self.session_id = models.new_session_id()
         
-        response = requests.post(
-            f"{self.base_url}/api/chat/message",
-            json={
-                "user_id": self.user_id or "anonymous",
-                "message": message,
-                "subject": subject,
-                "topic": topic,
-                "session_id": self.session_id
-            }
-        )
+        request = models.stream_message(self.user_id, self.session_id, message, subject, topic, fresh)
+        # Latency is recorded up to the response headers, i.e. time to first byte
+        start = time.perf_counter()
+        with self.transport.stream(request, timeout=self._timeout(request)) as (status_code, events):
+            self.stats.record(request.endpoint, time.perf_counter() - start, error=status_code >= 500)
+            if status_code != 200:
+                yield models.parse_response(request, status_code, None)
+                return
+            try:
+                yield from events
+            except Exception as e:
+                raise StreamInterrupted(str(e)) from e
+    
+    def get_chat_history(self, page_size=100):
+        """Get the history of the current chat session
+
+        A local copy is kept and only messages newer than it are fetched; the
+        ETag lets the backend answer 304 when nothing has changed.
+        """
+        if not self.session_id:
+            return {"error": "No active session"}
         
-        if response.status_code == 200:
-            return response.json()
-        return {"error": "Failed to get response", "response": "I'm having trouble processing your request right now."}
+        if self._history is None or self._history["session_id"] != self.session_id:
+            self._history = {"session_id": self.session_id, "etag": None, "data": None}
+        history = self._history
+        
+        while True:
+            since = history["data"]["next_since"] if history["data"] else 0
+            request = models.get_chat_history(self.session_id, since, page_size, history["etag"])
+            response = self._request(request)
+            if response.status_code == 304:
+                break
+            if response.status_code != 200:
+                return models.parse_response(request, response.status_code, None)
+            
+            page = response.json()
+            if history["data"] is None:
+                history["data"] = page
+            else:
+                history["data"]["messages"].extend(page["messages"])
+                history["data"].update({k: v for k, v in page.items() if k != "messages"})
+            # The ETag only describes the history once every page has been fetched
+            if page.get("has_more"):
+                history["etag"] = None
+            else:
+                history["etag"] = response.headers.get("ETag")
+                break
+        
+        return dict(history["data"], messages=list(history["data"]["messages"]))
     
-    def get_chat_history(self):
-        """Get the history of the current chat session"""
+    def get_earlier_messages(self, before=None, limit=20):
+        """Page backwards through the current session's history
+        
+        Returns the `limit` newest messages older than seq `before` (the newest
+        overall without it), with "before" as the cursor for the next page and
+        "has_earlier" telling whether there is one.
+        """
         if not self.session_id:
             return {"error": "No active session"}
+        return self._call(models.get_earlier_messages(self.session_id, before, limit))
+    
+    def batch(self, requests):
+        """Run several api_models requests in one round trip and return their results in order
         
-        response = requests.get(f"{self.base_url}/api/chat/{self.session_id}/history")
-        if response.status_code == 200:
-            return response.json()
-        return {"error": "Failed to get chat history"}
+        Reads are not served from the content cache here; a user created in the
+        batch becomes this client's user.
+        """
+        batch_request = models.batch(requests)
+        response = self._request(batch_request)
+        body = response.json() if response.status_code in models.BODY_STATUSES else None
+        results = models.parse_batch_response(requests, response.status_code, body)
+        for request, result in zip(requests, results):
+            if request.endpoint == "create_user" and "user_id" in result:
+                self.user_id = result["user_id"]
+        return results
     
     def get_progress(self):
         """Get the user's learning progress"""
         if not self.user_id:
             return {"error": "No user ID provided"}
+        return self._call(models.get_progress(self.user_id))
+
+    def get_cohort_analytics(self, education_level=None, offset=0, limit=50, top=10):
+        """Get class-wide progress analytics, optionally for one education level"""
+        return self._call(models.get_cohort_analytics(education_level, offset, limit, top))
+    
+    def health(self):
+        """Backend readiness, store and upstream model status
         
-        response = requests.get(f"{self.base_url}/api/progress/{self.user_id}")
-        if response.status_code == 200:
+        Cached for TUTOR_HEALTH_TTL seconds and shared by every clone; a check
+        is never retried and gives up after the "health" timeouts, reporting
+        the backend as unavailable.
+        """
+        return self.health_cache.get(self._check_health)
+    
+    def _check_health(self):
+        request = models.get_health()
+        try:
+            response = self._request(request)
+        except requests.RequestException as e:
+            return {"status": "unavailable", "ready": False, "error": str(e)}
+        # 503 still carries the health report
+        if response.status_code in (200, 503):
             return response.json()
-        return {"error": "Failed to get progress"}
+        return models.parse_response(request, response.status_code, None)
 
-# Create a singleton instance for use throughout the app
-api_client = TutorAPIClient()
+# Create a singleton instance for use throughout the app; its transport is
+# shared, use api_client.clone() for per-session user/session state
+api_client = TutorAPIClient(transport=create_transport())
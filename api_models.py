@@ -0,0 +1,184 @@
+import uuid
+from dataclasses import dataclass, field
+
+# Request/response models shared by TutorAPIClient and AsyncTutorAPIClient, so
+# both clients build the same requests and return the same shapes.
+
+CHAT_UNAVAILABLE = "I'm having trouble processing your request right now."
+CHAT_RATE_LIMITED = "You're sending messages faster than I can answer. Please wait a moment and try again."
+
+# Tells the backend whether a chat request is interactive or batch work
+PRIORITY_HEADER = "X-Request-Priority"
+RATE_LIMITED = 429
+# Statuses whose JSON body parse_response reads
+BODY_STATUSES = (200, RATE_LIMITED)
+
+
+@dataclass(frozen=True)
+class APIRequest:
+    """One backend call: HTTP method, path and payload"""
+    method: str
+    path: str
+    endpoint: str
+    timeout_group: str = "default"
+    params: dict = None
+    json: dict = None
+    headers: dict = field(default_factory=dict)
+    # Near-static responses the client may cache and revalidate by ETag
+    cacheable: bool = False
+    # Set False for calls that must fail fast rather than be retried
+    retry: bool = True
+
+    @property
+    def idempotent(self):
+        return self.method == "GET"
+
+    @property
+    def retryable(self):
+        return self.idempotent and self.retry
+
+
+def new_session_id():
+    return f"session_{uuid.uuid4().hex}"
+
+
+def create_user(name, education_level, user_id=None):
+    payload = {"name": name, "education_level": education_level}
+    if user_id:
+        payload["user_id"] = user_id
+    return APIRequest("POST", "/api/user", "create_user", json=payload)
+
+
+def get_user(user_id):
+    return APIRequest("GET", f"/api/user/{user_id}", "get_user")
+
+
+def get_subjects():
+    return APIRequest("GET", "/api/subjects", "get_subjects", cacheable=True)
+
+
+def get_topics(subject):
+    return APIRequest("GET", f"/api/subjects/{subject}/topics", "get_topics", cacheable=True)
+
+
+def get_content(subject, topic, level="beginner"):
+    return APIRequest("GET", f"/api/content/{subject}/{topic}", "get_content", params={"level": level},
+                      cacheable=True)
+
+
+def chat_payload(user_id, session_id, message, subject, topic="", fresh=False):
+    return {
+        "user_id": user_id or "anonymous",
+        "message": message,
+        "subject": subject,
+        "topic": topic,
+        "session_id": session_id,
+        "no_cache": fresh
+    }
+
+
+def send_message(user_id, session_id, message, subject, topic="", fresh=False):
+    return APIRequest("POST", "/api/chat/message", "send_message", timeout_group="chat",
+                      json=chat_payload(user_id, session_id, message, subject, topic, fresh))
+
+
+def stream_message(user_id, session_id, message, subject, topic="", fresh=False):
+    return APIRequest("POST", "/api/chat/message/stream", "stream_message", timeout_group="stream",
+                      json=chat_payload(user_id, session_id, message, subject, topic, fresh))
+
+
+def get_chat_history(session_id, since=0, limit=None, etag=None):
+    params = {"since": since}
+    if limit is not None:
+        params["limit"] = limit
+    return APIRequest("GET", f"/api/chat/{session_id}/history", "get_chat_history", params=params,
+                      headers={"If-None-Match": etag} if etag else {})
+
+
+def get_earlier_messages(session_id, before=None, limit=20):
+    """The `limit` newest messages older than seq `before`, or the newest `limit` overall"""
+    params = {"limit": limit}
+    if before is None:
+        params["tail"] = 1
+    else:
+        params["before"] = before
+    return APIRequest("GET", f"/api/chat/{session_id}/history", "get_earlier_messages", params=params)
+
+
+def get_progress(user_id):
+    return APIRequest("GET", f"/api/progress/{user_id}", "get_progress")
+
+
+def get_cohort_analytics(education_level=None, offset=0, limit=50, top=10):
+    params = {"offset": offset, "limit": limit, "top": top}
+    if education_level:
+        params["education_level"] = education_level
+    return APIRequest("GET", "/api/analytics/cohort", "get_cohort_analytics", timeout_group="analytics",
+                      params=params)
+
+
+def get_health():
+    return APIRequest("GET", "/api/health", "get_health", timeout_group="health", retry=False)
+
+
+def batch(requests):
+    """One round trip carrying several requests; see parse_batch_response()"""
+    return APIRequest("POST", "/api/batch", "batch", json={"requests": [
+        {
+            "id": index,
+            "method": request.method,
+            "path": request.path,
+            "params": request.params,
+            "body": request.json,
+            "headers": request.headers
+        }
+        for index, request in enumerate(requests)
+    ]})
+
+
+def parse_batch_response(requests, status_code, body):
+    """Per-request results, each shaped as if the request had been made on its own"""
+    if status_code != 200:
+        return [parse_response(request, status_code, None) for request in requests]
+    return [
+        parse_response(request, item["status"], item.get("body"))
+        for request, item in zip(requests, body["responses"])
+    ]
+
+
+# What each endpoint returns when the backend does not answer 200
+ERROR_RESPONSES = {
+    "create_user": {"error": "Failed to create user"},
+    "get_user": {"error": "Failed to get user"},
+    "get_subjects": [],
+    "get_topics": [],
+    "get_content": {"error": "Content not found"},
+    "send_message": {"error": "Failed to get response", "response": CHAT_UNAVAILABLE},
+    "stream_message": {"error": "Failed to get response", "response": CHAT_UNAVAILABLE, "done": True},
+    "get_chat_history": {"error": "Failed to get chat history"},
+    "get_earlier_messages": {"error": "Failed to get chat history"},
+    "get_progress": {"error": "Failed to get progress"},
+    "get_cohort_analytics": {"error": "Failed to get cohort analytics"},
+    "get_health": {"status": "unavailable", "ready": False, "error": "Health check failed"},
+}
+
+# Endpoints whose error responses also report the HTTP status
+REPORT_STATUS = {"create_user", "get_user"}
+
+
+def parse_response(request, status_code, body):
+    """Turn a backend reply into the value the client method returns"""
+    if status_code == 200:
+        return body
+    error = ERROR_RESPONSES.get(request.endpoint, {"error": "Request failed"})
+    if isinstance(error, list):
+        return list(error)
+    error = dict(error)
+    if status_code == RATE_LIMITED:
+        error["error"] = "Too many requests"
+        error["retry_after"] = (body or {}).get("retry_after")
+        if "response" in error:
+            error["response"] = CHAT_RATE_LIMITED
+    if request.endpoint in REPORT_STATUS:
+        error["status_code"] = status_code
+    return error
@@ -1,29 +1,48 @@
 import streamlit as st
 from streamlit_chat import message
 from streamlit_drawable_canvas import st_canvas
+import html
 import json
 import time
 from datetime import datetime
 import os
 import threading
+import uuid
 
 # Import our API client to communicate with the backend
-from api_client import api_client
+import api_models
+from api_client import api_client as shared_api_client
+from chat_jobs import RUNNING, ChatJobQueue
+from concurrent.futures import ThreadPoolExecutor
 
-# Display a warning if backend is not running
-import socket
-def is_backend_running():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        try:
-            # Try to connect to the backend
-            s.connect(('localhost', 5000))
-            return True
-        except:
-            return False
+# How often the page refreshes while chat answers are being generated
+CHAT_POLL_SECONDS = float(os.getenv("TUTOR_CHAT_POLL_MS", "500")) / 1000
+
+# One worker pool for chat submissions from every browser session. No
+# spinner: this runs before set_page_config, which must be the first call
+@st.cache_resource(show_spinner=False)
+def chat_executor():
+    return ThreadPoolExecutor(max_workers=int(os.getenv("TUTOR_CHAT_WORKERS", "8")))
 
-# Check if backend is running
-backend_status = is_backend_running()
-if not backend_status:
+# Each browser session keeps its own user/session ids on the shared transport
+if 'api_client' not in st.session_state:
+    st.session_state.api_client = shared_api_client.clone()
+    st.session_state.chat_jobs = ChatJobQueue(st.session_state.api_client, chat_executor())
+api_client = st.session_state.api_client
+
+# Page config
+st.set_page_config(
+    page_title="Tutor AI",
+    page_icon="🎓",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# Display a warning if backend is not ready. This must come after
+# set_page_config, the first Streamlit call; the health check is cached for a
+# few seconds and has a hard timeout, so reruns don't wait on it
+health = api_client.health()
+if not health.get('ready'):
     st.warning("""
     ⚠️ Backend server is not running. Please start it by running the following in a separate terminal:
     
@@ -34,15 +53,8 @@ if not backend_status:
     
     Then refresh this page.
     """)
-
-
-# Page config
-st.set_page_config(
-    page_title="Tutor AI",
-    page_icon="🎓",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+elif health.get('status') == 'degraded':
+    st.info("The AI model is not responding right now; answers may be shorter than usual.")
 
 # Custom CSS
 st.markdown("""
@@ -72,12 +84,34 @@ st.markdown("""
     .tool-button {
         margin: 2px !important;
     }
+    .chat-message {
+        padding: 8px 12px;
+        border-radius: 8px;
+        margin: 6px 0;
+        max-width: 80%;
+    }
+    .user-message {
+        background-color: #e8f0fe;
+        margin-left: auto;
+    }
+    .ai-message {
+        background-color: #f0f2f6;
+    }
 </style>
 """, unsafe_allow_html=True)
 
+# Only the most recent CHAT_WINDOW messages are kept and rendered as chat
+# components; older ones are paged back in from the backend on request
+CHAT_WINDOW = int(os.getenv("TUTOR_CHAT_WINDOW", "20"))
+
 # Initialize session state variables
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+    st.session_state.earlier_messages = []
+    st.session_state.earlier_cursor = None
+    st.session_state.has_earlier = False
+    st.session_state.newest_seq = None
+    st.session_state.questions_asked = 0
 if 'whiteboard_mode' not in st.session_state:
     st.session_state.whiteboard_mode = False
 if 'show_equation_editor' not in st.session_state:
@@ -100,32 +134,82 @@ def initialize_session():
         name = st.session_state.get('student_name', 'New Student')
         education_level = st.session_state.get('education_level', 'Beginner')
         
-        # Create user in backend
+        # Create user in backend and load the subject library in one round trip
         try:
-            user_data = api_client.create_user(name, education_level)
+            user_data, subjects = api_client.batch([
+                api_models.create_user(name, education_level, user_id=f"user_{uuid.uuid4().hex[:12]}"),
+                api_models.get_subjects()
+            ])
             if 'user_id' in user_data:
                 st.session_state.user_id = user_data['user_id']
                 st.session_state.user_created = True
+            st.session_state.library_subjects = subjects
         except Exception as e:
             st.error(f"Could not connect to backend service. Please make sure it's running. Error: {e}")
 
-# Function to get AI response via the backend API
-def get_ai_response(question, subject, topic=""):
-    try:
-        # Send the message to the backend
-        response_data = api_client.send_message(
-            message=question,
-            subject=subject,
-            topic=topic
-        )
-        
-        # Extract the AI response from the returned data
-        ai_response = response_data.get('response', "I'm having trouble processing your request right now.")
-        return ai_response
-    except Exception as e:
-        # Fallback response if API call fails
-        st.error(f"Could not get response from backend. Error: {e}")
-        return "I'm sorry, I'm having trouble connecting to my knowledge base. Please try again later."
+# Chat transcript helpers; `seq` is the message's place in the backend history,
+# None for messages only shown here (rate-limited or failed turns)
+def add_message(role, content, seq=None):
+    st.session_state.messages.append({"id": uuid.uuid4().hex[:12], "role": role, "content": content, "seq": seq})
+    if seq is not None:
+        st.session_state.newest_seq = max(seq, st.session_state.newest_seq or 0)
+    if role == "user":
+        st.session_state.questions_asked += 1
+    
+    # Keep only the recent window; anything older can be paged in again
+    overflow = len(st.session_state.messages) - CHAT_WINDOW
+    if overflow > 0:
+        dropped = st.session_state.messages[:overflow]
+        del st.session_state.messages[:overflow]
+        if st.session_state.earlier_cursor is not None:
+            st.session_state.earlier_messages.extend(dropped)
+        else:
+            st.session_state.has_earlier = True
+
+def window_cursor():
+    """Seq to page back from: the oldest stored message still in the window"""
+    seqs = [m["seq"] for m in st.session_state.messages if m.get("seq") is not None]
+    if seqs:
+        return min(seqs)
+    # Only unsaved messages left in the window: everything stored is older
+    return st.session_state.newest_seq + 1 if st.session_state.newest_seq else None
+
+def load_earlier_messages():
+    before = st.session_state.earlier_cursor
+    if before is None:
+        before = window_cursor()
+        if before is None:
+            # Nothing was ever stored, so there is nothing to page back to
+            st.session_state.has_earlier = False
+            return
+    page = api_client.get_earlier_messages(before=before, limit=CHAT_WINDOW)
+    if 'error' in page:
+        st.error(f"Could not load earlier messages: {page['error']}")
+        return
+    
+    st.session_state.earlier_messages[:0] = [
+        {"id": f"seq_{m['seq']}", "role": m['role'], "content": m['content'], "seq": m['seq']}
+        for m in page.get('messages', [])
+    ]
+    st.session_state.earlier_cursor = page['before']
+    st.session_state.has_earlier = page['has_earlier']
+
+@st.cache_data(max_entries=4096, show_spinner=False)
+def message_html(role, content):
+    # Rendered once per distinct message, then reused on every rerun
+    css_class = "user-message" if role == "user" else "ai-message"
+    body = html.escape(content).replace("\n", "<br>")
+    return f'<div class="chat-message {css_class}">{body}</div>'
+
+def render_earlier_messages():
+    if st.session_state.has_earlier:
+        st.button("⬆️ Load earlier messages", key="load_earlier", on_click=load_earlier_messages)
+    if st.session_state.earlier_messages:
+        with st.expander(f"Earlier messages ({len(st.session_state.earlier_messages)})", expanded=True):
+            st.markdown(
+                "".join(message_html(m["role"], m["content"]) for m in st.session_state.earlier_messages),
+                unsafe_allow_html=True
+            )
 
 # Sidebar
 with st.sidebar:
@@ -138,10 +222,15 @@ with st.sidebar:
                     ["High School", "Undergraduate", "Graduate", "Professional"],
                     key="education_level")
     
+    # Initialize the session on first load, once the profile widgets hold the
+    # student's name and level and before the subject list needs the library
+    initialize_session()
+    
     # Subject/Topic Selection
     with st.expander("📚 Subjects", expanded=True):
-        subject = st.selectbox("Select Subject", 
-                            ["Mathematics", "Physics", "Computer Science", "Chemistry", "Biology"])
+        subject_options = ["Mathematics", "Physics", "Computer Science", "Chemistry", "Biology"]
+        subject_options += [name for name in st.session_state.get('library_subjects', []) if name not in subject_options]
+        subject = st.selectbox("Select Subject", subject_options)
         topic = st.text_input("Specific Topic", placeholder="e.g., Linear Algebra, Quantum Mechanics")
     
     # Learning Progress
@@ -210,17 +299,37 @@ with tab1:
                 st.latex(equation)
         st.divider()
     
+    # Move answers finished in the background into the transcript
+    for job in st.session_state.chat_jobs.collect_finished():
+        if job.started:
+            add_message("user", job.question, job.question_seq)
+        if job.response is not None:
+            add_message("ai", job.response, job.response_seq)
+    
     # Chat Display
     chat_container = st.container()
     with chat_container:
-        if not st.session_state.messages:
+        pending_jobs = st.session_state.chat_jobs.jobs()
+        if not st.session_state.messages and not pending_jobs:
             st.info("👋 Hello! I'm your Tutor AI assistant. How can I help you with your learning today?")
         else:
-            for i, msg in enumerate(st.session_state.messages):
-                if msg["role"] == "ai":
-                    message(msg["content"], is_user=False, key=f"ai_{i}")
+            render_earlier_messages()
+            # Stable per-message keys let Streamlit reuse unchanged components
+            for msg in st.session_state.messages:
+                message(msg["content"], is_user=msg["role"] != "ai", key=f"msg_{msg['id']}")
+        
+        # Questions still being answered, with what has streamed in so far
+        for job in pending_jobs:
+            message(job.question, is_user=True, key=f"job_{job.id}")
+            col1, col2 = st.columns([5, 1])
+            with col1:
+                if job.status == RUNNING and job.partial:
+                    st.markdown(job.partial + "▌")
                 else:
-                    message(msg["content"], is_user=True, key=f"user_{i}")
+                    st.caption("Thinking..." if job.status == RUNNING else "Queued")
+            with col2:
+                st.button("Cancel", key=f"cancel_{job.id}", on_click=st.session_state.chat_jobs.cancel,
+                          args=(job.id,))
     
     # Chat Input
     st.divider()
@@ -237,87 +346,49 @@ with tab1:
         with col4:
             practice = st.form_submit_button("Practice Problem", use_container_width=True)
     
-    # Initialize the session on first load
-    initialize_session()
-    
     # Get the current selected subject and topic
     current_subject = subject  # From the sidebar selectbox
     current_topic = topic      # From the sidebar text input
     
-    # Process input
+    # Every submission goes to the background queue; the answer shows up on a later rerun
+    query = None
     if submit and user_input:
-        # Add user message to chat
-        st.session_state.messages.append({"role": "user", "content": user_input})
-        
-        # Get AI response via backend with loading indicator
-        with st.spinner("Thinking..."):
-            ai_response = get_ai_response(
-                question=user_input,
-                subject=current_subject,
-                topic=current_topic
-            )
-            st.session_state.messages.append({"role": "ai", "content": ai_response})
-        
-        # Force a rerun to show the new message
-        st.rerun()
-    
-    # Quick action buttons
-    if explain_more:
+        query = user_input
+    elif explain_more:
         query = "Can you explain this in more detail?"
-        st.session_state.messages.append({"role": "user", "content": query})
-        with st.spinner("Thinking..."):
-            ai_response = get_ai_response(
-                question=query,
-                subject=current_subject,
-                topic=current_topic
-            )
-            st.session_state.messages.append({"role": "ai", "content": ai_response})
-        st.rerun()
-        
-    if give_example:
+    elif give_example:
         query = "Can you give me an example?"
-        st.session_state.messages.append({"role": "user", "content": query})
-        with st.spinner("Thinking..."):
-            ai_response = get_ai_response(
-                question=query,
-                subject=current_subject,
-                topic=current_topic
-            )
-            st.session_state.messages.append({"role": "ai", "content": ai_response})
-        st.rerun()
-        
-    if practice:
+    elif practice:
         query = "Give me a practice problem to solve."
-        st.session_state.messages.append({"role": "user", "content": query})
-        with st.spinner("Thinking..."):
-            ai_response = get_ai_response(
-                question=query,
-                subject=current_subject,
-                topic=current_topic
-            )
-            st.session_state.messages.append({"role": "ai", "content": ai_response})
+    
+    if query:
+        st.session_state.chat_jobs.submit(query, current_subject, current_topic)
         st.rerun()
 
 with tab2:
     st.header("Learning Analytics")
     
-    # Subject Progress
+    # Subject Progress, averaged over every student at this education level
     st.subheader("Progress by Subject")
+    try:
+        cohort = api_client.get_cohort_analytics(education_level=st.session_state.get('education_level'))
+    except Exception:
+        cohort = {"error": "Backend unavailable"}
     progress_data = {
-        "Mathematics": 75,
-        "Physics": 60,
-        "Computer Science": 90,
-        "Chemistry": 45,
-        "Biology": 30
+        subject: stats["average_progress"]
+        for subject, stats in cohort.get("subjects", {}).items()
     }
     
-    st.bar_chart(progress_data)
+    if progress_data:
+        st.bar_chart(progress_data)
+    else:
+        st.info("No progress recorded yet for this education level.")
     
     # Session Metrics
     st.subheader("Session Metrics")
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Questions Asked", str(len([m for m in st.session_state.messages if m["role"] == "user"])))
+        st.metric("Questions Asked", str(st.session_state.questions_asked))
     with col2:
         st.metric("Session Length", f"{minutes:02d}:{seconds:02d}")
     with col3:
@@ -389,3 +460,8 @@ with tab3:
 # Footer
 st.divider()
 st.caption("© 2025 Tutor AI - Your Personal Learning Assistant")
+
+# Refresh to pick up background answers; any interaction interrupts the wait
+if st.session_state.chat_jobs.jobs():
+    time.sleep(CHAT_POLL_SECONDS)
+    st.rerun()
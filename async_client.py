@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+
+import aiohttp
+
+import api_models as models
+from api_client import BASE_URL, DEFAULT_TIMEOUTS, LatencyStats
+
+
+async def bounded_gather(coroutines, limit=10, return_exceptions=False):
+    """asyncio.gather that runs at most `limit` of the coroutines at once"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(run(c) for c in coroutines), return_exceptions=return_exceptions)
+
+
+class AsyncTutorAPIClient:
+    """Asyncio client for the Tutor AI backend API
+
+    Mirrors TutorAPIClient, built on the same api_models requests and
+    responses. At most `max_concurrency` requests are in flight at once. Chat
+    methods accept explicit user_id/session_id so one client can drive many
+    sessions concurrently.
+
+        async with AsyncTutorAPIClient() as client:
+            users = await client.gather(client.create_user(n, "Beginner") for n in names)
+    """
+
+    def __init__(self, base_url=BASE_URL, max_concurrency=None, timeouts=None, retries=None, backoff=None):
+        self.base_url = base_url
+        self.session_id = None
+        self.user_id = None
+        self.max_concurrency = max_concurrency or int(os.getenv("TUTOR_API_POOL_SIZE", "10"))
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.retries = int(os.getenv("TUTOR_API_RETRIES", "3")) if retries is None else retries
+        self.backoff = float(os.getenv("TUTOR_API_BACKOFF", "0.2")) if backoff is None else backoff
+        self.stats = LatencyStats()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._http = None
+
+    async def __aenter__(self):
+        # Bulk traffic, so its chat requests queue behind interactive ones
+        self._http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+            headers={models.PRIORITY_HEADER: "batch"}
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    def latency_stats(self):
+        return self.stats.summary()
+
+    async def gather(self, coroutines, limit=None, return_exceptions=False):
+        """Run many client calls with bounded parallelism"""
+        return await bounded_gather(coroutines, limit or self.max_concurrency, return_exceptions)
+
+    async def _call(self, request):
+        if self._http is None:
+            raise RuntimeError("AsyncTutorAPIClient must be used as 'async with AsyncTutorAPIClient() as client'")
+        connect, read = self.timeouts.get(request.timeout_group, self.timeouts["default"])
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        attempts = self.retries + 1 if request.retryable else 1
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            start = asyncio.get_running_loop().time()
+            error = True
+            try:
+                async with self._semaphore:
+                    async with self._http.request(
+                        request.method,
+                        f"{self.base_url}{request.path}",
+                        params=request.params,
+                        json=request.json,
+                        headers=request.headers,
+                        timeout=timeout
+                    ) as response:
+                        error = response.status >= 500
+                        if not (response.status in (502, 503, 504) and not last_attempt):
+                            body = await response.json() if response.status in models.BODY_STATUSES else None
+                            return models.parse_response(request, response.status, body)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if last_attempt:
+                    raise
+            finally:
+                self.stats.record(request.endpoint, asyncio.get_running_loop().time() - start, error=error)
+            # Retry idempotent requests with exponential backoff
+            await asyncio.sleep(self.backoff * (2 ** attempt))
+
+    async def create_user(self, name, education_level):
+        """Create a new user profile"""
+        data = await self._call(models.create_user(name, education_level))
+        if "user_id" in data:
+            self.user_id = data.get("user_id")
+        return data
+
+    async def get_user(self, user_id=None):
+        """Get user profile and progress"""
+        user_id = user_id or self.user_id
+        if not user_id:
+            return {"error": "No user ID provided"}
+        return await self._call(models.get_user(user_id))
+
+    async def get_subjects(self):
+        """Get list of available subjects"""
+        return await self._call(models.get_subjects())
+
+    async def get_topics(self, subject):
+        """Get topics for a specific subject"""
+        return await self._call(models.get_topics(subject))
+
+    async def get_content(self, subject, topic, level="beginner"):
+        """Get educational content for a subject and topic"""
+        return await self._call(models.get_content(subject, topic, level))
+
+    async def send_message(self, message, subject, topic="", fresh=False, user_id=None, session_id=None):
+        """Send a message to the AI tutor and get a response"""
+        if session_id is None:
+            if not self.session_id:
+                self.session_id = models.new_session_id()
+            session_id = self.session_id
+        return await self._call(
+            models.send_message(user_id or self.user_id, session_id, message, subject, topic, fresh)
+        )
+
+    async def get_chat_history(self, session_id=None, since=0, limit=None):
+        """Get the messages of a chat session after seq `since`"""
+        session_id = session_id or self.session_id
+        if not session_id:
+            return {"error": "No active session"}
+        return await self._call(models.get_chat_history(session_id, since, limit))
+
+    async def get_progress(self, user_id=None):
+        """Get a user's learning progress"""
+        user_id = user_id or self.user_id
+        if not user_id:
+            return {"error": "No user ID provided"}
+        return await self._call(models.get_progress(user_id))
+
+    async def get_cohort_analytics(self, education_level=None, offset=0, limit=50, top=10):
+        """Get class-wide progress analytics, optionally for one education level"""
+        return await self._call(models.get_cohort_analytics(education_level, offset, limit, top))
+
+
+if __name__ == '__main__':
+    # Nightly export: python async_client.py <user_id> [<user_id> ...]
+    import sys
+
+    async def export(user_ids):
+        async with AsyncTutorAPIClient() as client:
+            progress = await client.gather(client.get_progress(user_id) for user_id in user_ids)
+        print(json.dumps(dict(zip(user_ids, progress)), indent=2))
+
+    asyncio.run(export(sys.argv[1:]))
@@ -1,9 +1,31 @@
 import os
 import json
-from flask import Flask, request, jsonify
+import atexit
+import functools
+import hashlib
+import math
+import time
+import uuid
+from flask import Flask, Response
 from datetime import datetime
 import cohere
+from cohere.responses.classify import Example as ClassifyExample
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from admission import AdmissionController, BATCH, INTERACTIVE, RateLimited
+from analytics import CohortAnalytics
+from batcher import MicroBatcher
+from circuit import BudgetExceeded, CircuitBreaker, CircuitOpenError, LatencyBudget
+from classifier import LocalQuestionClassifier, SEED_EXAMPLES, load_training_file
+from context import ConversationContext
+from health import UpstreamHealth
+from metrics import TOKEN_BUCKETS, count_tokens, registry, render_samples
+from profiling import ProfileStore
+from response_cache import ResponseCache
+from retrieval import ContentIndex
+from service import ApiResult, EventStream, api_route, as_result, dispatch, etag_header, not_modified
+from singleflight import SingleFlight
+from storage import create_store
 
 # Load environment variables from .env file
 load_dotenv()
@@ -13,11 +35,55 @@ app = Flask(__name__)
 # Initialize Cohere client - securely accessing the API key from environment
 # DO NOT hardcode API keys in your code
 cohere_api_key = os.getenv("COHERE_API_KEY")
-co = cohere.Client(cohere_api_key)
+# COHERE_API_URL points the client elsewhere, e.g. at fake_cohere.py for benchmarks
+co = cohere.Client(cohere_api_key, api_url=os.getenv("COHERE_API_URL"))
+
+# Outcomes of recent Cohere calls, reported by /api/health
+upstream_health = UpstreamHealth()
+started_at = time.time()
+
+# Chat pipeline metrics, served in Prometheus text format at /metrics
+CHAT_STAGE_SECONDS = registry.histogram(
+    'tutor_chat_stage_seconds', 'Time spent in each stage of the chat pipeline', ('stage',)
+)
+CHAT_RESPONSES = registry.counter(
+    'tutor_chat_responses_total', 'Chat answers by where they came from: cache, model or fallback', ('source',)
+)
+CHAT_FALLBACKS = registry.counter(
+    'tutor_chat_fallbacks_total', 'Fallback answers by the error that caused them', ('reason',)
+)
+CHAT_TOKENS = registry.histogram(
+    'tutor_chat_tokens', 'Approximate prompt and response sizes in tokens', ('kind',), buckets=TOKEN_BUCKETS
+)
+
+# With PROFILING_ENABLED=1, requests sent with `X-Profile: 1` are sampled; the
+# profile id comes back in X-Profile-Id. Off by default: any client could ask
+PROFILE_HEADER = 'X-Profile'
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+profiles = ProfileStore(
+    size=int(os.getenv("PROFILE_HISTORY", "20")),
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+)
+
+def profiled(fn):
+    @functools.wraps(fn)
+    def wrapper(call, **view_args):
+        if not PROFILING_ENABLED or call.header(PROFILE_HEADER) != '1':
+            return fn(call, **view_args)
+        with profiles.profile(fn.__name__) as profile_id:
+            result = as_result(fn(call, **view_args))
+        if isinstance(result, EventStream):
+            return result
+        return ApiResult(result.body, result.status, dict(result.headers, **{'X-Profile-Id': profile_id}))
+    return wrapper
+
+# Users, sessions and progress live in the configured store (in-memory by default)
+store = create_store()
+atexit.register(store.close)
+
+# Class-wide progress snapshots, rebuilt at most every ANALYTICS_SNAPSHOT_TTL seconds
+cohort_analytics = CohortAnalytics(store, ttl=float(os.getenv("ANALYTICS_SNAPSHOT_TTL", "30")))
 
-# In-memory storage for MVP (would use a database in production)
-users = {}
-sessions = {}
 content_library = {
     "Mathematics": {
         "Algebra": {
@@ -47,111 +113,147 @@ content_library = {
     }
 }
 
-# Routes for User Management
-@app.route('/api/user', methods=['POST'])
-def create_user():
-    data = request.json
-    user_id = data.get('user_id', str(len(users) + 1))
-    users[user_id] = {
-        'name': data.get('name', 'Student'),
-        'education_level': data.get('education_level', 'Beginner'),
-        'created_at': datetime.now().isoformat(),
-        'progress': {},
-        'session_count': 0
-    }
-    return jsonify({'user_id': user_id, 'status': 'created'})
+# BM25 index over the library; update_topic() re-indexes a topic whose content
+# changes. Chat prompts get the top RETRIEVAL_TOP_K snippets scoring at least
+# RETRIEVAL_MIN_SCORE; with LIBRARY_ANSWERS on, questions the library answers
+# alone skip the model
+content_index = ContentIndex(content_library)
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "1.0"))
+LIBRARY_ANSWERS = os.getenv("LIBRARY_ANSWERS", "1") == "1"
 
-@app.route('/api/user/<user_id>', methods=['GET'])
-def get_user(user_id):
-    if user_id in users:
-        return jsonify(users[user_id])
-    return jsonify({'error': 'User not found'}), 404
+# How long clients may reuse content responses before revalidating them
+CONTENT_MAX_AGE = int(os.getenv("CONTENT_MAX_AGE", "60"))
 
-# Routes for Content
-@app.route('/api/subjects', methods=['GET'])
-def get_subjects():
-    return jsonify(list(content_library.keys()))
+# Labelled examples sent to co.classify; the local classifier trains on these too
+CLASSIFY_EXAMPLES = [
+    {"text": "Can you explain how to solve quadratic equations?", "label": "explanation"},
+    {"text": "Give me an example of Newton's second law", "label": "example"},
+    {"text": "I need a practice problem on linked lists", "label": "practice"},
+    {"text": "What is the definition of a derivative?", "label": "definition"},
+    {"text": "How do I calculate the area of a circle?", "label": "how-to"}
+]
 
-@app.route('/api/subjects/<subject>/topics', methods=['GET'])
-def get_topics(subject):
-    if subject in content_library:
-        return jsonify(list(content_library[subject].keys()))
-    return jsonify({'error': 'Subject not found'}), 404
+# The SDK reads .text and .label, so co.classify gets them as ClassifyExample objects
+COHERE_CLASSIFY_EXAMPLES = [ClassifyExample(text=e["text"], label=e["label"]) for e in CLASSIFY_EXAMPLES]
 
-@app.route('/api/content/<subject>/<topic>', methods=['GET'])
-def get_content(subject, topic):
-    level = request.args.get('level', 'beginner')
-    if subject in content_library and topic in content_library[subject]:
-        content = content_library[subject][topic]
-        return jsonify({
-            'subject': subject,
-            'topic': topic,
-            'content': content.get(level, content.get('beginner')),
-            'examples': content.get('examples', []),
-            'practice': content.get('practice', [])
-        })
-    return jsonify({'error': 'Content not found'}), 404
+# Local question-type classifier, trained once at startup
+question_classifier = LocalQuestionClassifier(
+    CLASSIFY_EXAMPLES + SEED_EXAMPLES + load_training_file(os.getenv("QUESTION_TYPE_TRAINING_FILE")),
+    threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.75"))
+)
 
-# Chat and AI Interaction
-@app.route('/api/chat/message', methods=['POST'])
-def process_message():
-    data = request.json
-    user_id = data.get('user_id', 'anonymous')
-    message = data.get('message', '')
-    subject = data.get('subject', 'General')
-    topic = data.get('topic', '')
-    session_id = data.get('session_id', f"session_{len(sessions) + 1}")
-    
-    # Store the message in session history
-    if session_id not in sessions:
-        sessions[session_id] = {
-            'user_id': user_id,
-            'subject': subject,
-            'topic': topic,
-            'messages': [],
-            'start_time': datetime.now().isoformat()
-        }
-    
-    sessions[session_id]['messages'].append({
-        'role': 'user',
-        'content': message,
-        'timestamp': datetime.now().isoformat()
-    })
-    
-    # Use Cohere to understand the question type
-    try:
+def keyword_question_type(message):
+    # Fallback if Cohere API fails
+    if "explain" in message.lower() or "what is" in message.lower():
+        return "explanation"
+    elif "example" in message.lower():
+        return "example"
+    elif "practice" in message.lower() or "problem" in message.lower():
+        return "practice"
+    return "explanation"
+
+def classify_remote(messages):
+    # One co.classify call for a whole batch of messages
+    with upstream_health.call('classify'):
         classification = co.classify(
             model='embed-english-v3.0',
-            inputs=[message],
-            examples=[
-                {"text": "Can you explain how to solve quadratic equations?", "label": "explanation"},
-                {"text": "Give me an example of Newton's second law", "label": "example"},
-                {"text": "I need a practice problem on linked lists", "label": "practice"},
-                {"text": "What is the definition of a derivative?", "label": "definition"},
-                {"text": "How do I calculate the area of a circle?", "label": "how-to"}
-            ]
+            inputs=messages,
+            examples=COHERE_CLASSIFY_EXAMPLES
         )
-        question_type = classification.classifications[0].prediction
+    return [c.predictions[0] for c in classification.classifications]
+
+# Per-operation circuit breakers: while Cohere keeps failing or answering too
+# slowly, requests skip it and use the local fallbacks straight away
+def circuit_breaker(name):
+    return CircuitBreaker(
+        name,
+        failure_rate=float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5")),
+        window=int(os.getenv("CIRCUIT_WINDOW", "20")),
+        min_calls=int(os.getenv("CIRCUIT_MIN_CALLS", "5")),
+        open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+        slow_call_seconds=float(os.getenv("CIRCUIT_SLOW_CALL_MS", "10000")) / 1000
+    )
+
+classify_breaker = circuit_breaker('classify')
+generate_breaker = circuit_breaker('generate')
+
+# Time one chat request may spend waiting on Cohere in total, and the most of
+# it classification may use
+REQUEST_BUDGET = float(os.getenv("REQUEST_LATENCY_BUDGET_MS", "15000")) / 1000
+CLASSIFY_BUDGET = float(os.getenv("CLASSIFY_LATENCY_BUDGET_MS", "1500")) / 1000
+
+# Ambiguous messages from concurrent requests share co.classify calls
+classify_batcher = MicroBatcher(
+    classify_remote,
+    max_batch=int(os.getenv("CLASSIFY_BATCH_SIZE", "32")),
+    window=float(os.getenv("CLASSIFY_BATCH_WINDOW_MS", "10")) / 1000
+)
+
+# Admission control for chat: each user and the whole process get a token
+# bucket (a rate of 0 disables it). Requests over the global rate wait briefly
+# in a priority queue, interactive before batch, and past that get a 429
+admission = AdmissionController(
+    user_rate=float(os.getenv("RATE_LIMIT_USER_PER_MIN", "20")) / 60,
+    user_burst=int(os.getenv("RATE_LIMIT_USER_BURST", "5")),
+    global_rate=float(os.getenv("RATE_LIMIT_GLOBAL_PER_SEC", "10")),
+    global_burst=int(os.getenv("RATE_LIMIT_GLOBAL_BURST", "20")),
+    max_queue=int(os.getenv("ADMISSION_QUEUE_SIZE", "50")),
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT_MS", "2000")) / 1000
+)
+PRIORITY_HEADER = 'X-Request-Priority'
+
+def classify_question(message, budget=None):
+    question_type, confidence = question_classifier.predict(message)
+    if question_classifier.is_confident(confidence):
+        question_classifier.record('local')
+        return question_type
+    
+    # Ambiguous message - use Cohere to understand the question type, unless it
+    # is failing anyway or the request can't afford the wait
+    try:
+        with classify_breaker.guard():
+            question_classifier.record('remote')
+            timeout = budget.remaining(cap=CLASSIFY_BUDGET) if budget else None
+            if timeout is not None and timeout <= 0:
+                raise BudgetExceeded("latency budget exhausted")
+            return classify_batcher.submit(message, timeout=timeout)
+    except CircuitOpenError:
+        question_classifier.record('circuit_open')
+        return keyword_question_type(message)
     except Exception as e:
-        # Fallback if Cohere API fails
         print(f"Cohere classification error: {e}")
-        if "explain" in message.lower() or "what is" in message.lower():
-            question_type = "explanation"
-        elif "example" in message.lower():
-            question_type = "example"
-        elif "practice" in message.lower() or "problem" in message.lower():
-            question_type = "practice"
-        else:
-            question_type = "explanation"
-    
-    # Generate response based on question type and context
+        question_classifier.record('remote_error')
+        return keyword_question_type(message)
+
+def context_text(conversation):
+    """The conversation so far as prompt text ('' when there is none)"""
+    if not conversation:
+        return ""
+    text = ""
+    if conversation['summary']:
+        text += f"Summary of the earlier conversation:\n{conversation['summary']}\n"
+    if conversation['turns']:
+        text += "Most recent messages:\n" + "\n".join(conversation['turns']) + "\n"
+    return text
+
+def library_text(snippets):
+    """Retrieved course material as prompt text ('' when there is none)"""
+    if not snippets:
+        return ""
+    lines = [f"- ({snippet.topic}, {snippet.kind}) {snippet.text}" for snippet in snippets]
+    return "Course material that may help (use it where relevant):\n" + "\n".join(lines) + "\n"
+
+def build_prompt(subject, topic, education_level, question_type, message, conversation=None, snippets=None):
     context = f"The student is learning about {subject}, specifically {topic}. "
-    context += f"Their education level is {users.get(user_id, {}).get('education_level', 'Beginner')}. "
+    context += f"Their education level is {education_level}. "
+    if conversation:
+        context += f"\n{context_text(conversation)}"
+    if snippets:
+        context += f"\n{library_text(snippets)}"
     context += f"They asked: '{message}'"
     
-    try:
-        # Use Cohere's generation capabilities
-        response_prompt = f"""
+    return f"""
         You are a helpful AI tutor specialized in {subject}.
         {context}
         
@@ -159,95 +261,591 @@ def process_message():
         
         Please provide a clear, concise, and educational response that is appropriate for their level.
         """
-        
+
+# Answer length; grounded prompts already carry library material, so they get less
+MAX_TOKENS = 300
+GROUNDED_MAX_TOKENS = int(os.getenv("GROUNDED_MAX_TOKENS", "200"))
+
+def generate_response(prompt, budget=None, max_tokens=MAX_TOKENS):
+    # Fails fast while the circuit is open, gives up when the budget runs out
+    with generate_breaker.guard():
+        return budget.run(generate_remote, prompt, max_tokens) if budget else generate_remote(prompt, max_tokens)
+
+def generate_remote(prompt, max_tokens=MAX_TOKENS):
+    # Use Cohere's generation capabilities
+    with upstream_health.call('generate'):
         generation = co.generate(
             model='command',
-            prompt=response_prompt,
-            max_tokens=300,
+            prompt=prompt,
+            max_tokens=max_tokens,
             temperature=0.7,
         )
-        ai_response = generation.generations[0].text.strip()
-    except Exception as e:
-        # Fallback responses if Cohere API fails
-        print(f"Cohere generation error: {e}")
-        fallback_responses = {
-            "explanation": f"I'd be happy to explain about {topic} in {subject}. This is a fundamental concept where...",
-            "example": f"Here's an example related to {topic}: Consider a scenario where...",
-            "practice": f"Try solving this {topic} problem: [Sample problem related to the topic]",
-            "definition": f"The definition of {topic} is: [Brief definition]",
-            "how-to": f"To solve problems related to {topic}, follow these steps: 1. First... 2. Then..."
-        }
-        ai_response = fallback_responses.get(question_type, "I understand your question. Let me help you with that.")
+    return generation.generations[0].text.strip()
+
+def open_stream(prompt, max_tokens=MAX_TOKENS):
+    # Start a streamed generation and wait for its first chunk
+    stream = iter(co.generate(
+        model='command',
+        prompt=prompt,
+        max_tokens=max_tokens,
+        temperature=0.7,
+        stream=True,
+    ))
+    return stream, next(stream, None)
+
+def stream_response(prompt, budget=None, max_tokens=MAX_TOKENS):
+    # Same generation, yielding text chunks as the model produces them. The
+    # breaker and budget cover the wait for the first chunk; the rest streams
+    with upstream_health.call('generate_stream'):
+        with generate_breaker.guard():
+            stream, first = budget.run(open_stream, prompt, max_tokens) if budget else open_stream(prompt, max_tokens)
+        if first is not None and first.text:
+            yield first.text
+        for item in stream:
+            if item.text:
+                yield item.text
+
+def fallback_response(question_type, subject, topic):
+    fallback_responses = {
+        "explanation": f"I'd be happy to explain about {topic} in {subject}. This is a fundamental concept where...",
+        "example": f"Here's an example related to {topic}: Consider a scenario where...",
+        "practice": f"Try solving this {topic} problem: [Sample problem related to the topic]",
+        "definition": f"The definition of {topic} is: [Brief definition]",
+        "how-to": f"To solve problems related to {topic}, follow these steps: 1. First... 2. Then..."
+    }
+    return fallback_responses.get(question_type, "I understand your question. Let me help you with that.")
+
+# Cache of generated responses for repeated questions (e.g. the quick-action buttons)
+response_cache = ResponseCache(
+    max_size=int(os.getenv("RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+)
+
+# Identical generations already in flight are shared instead of repeated
+generation_flight = SingleFlight()
+
+# Earlier turns of a session sent along with each prompt: recent messages
+# verbatim within CONTEXT_TOKEN_BUDGET (0 turns context off), older ones as a
+# cached rolling summary within CONTEXT_SUMMARY_BUDGET
+conversation_context = ConversationContext(
+    store,
+    token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "600")),
+    summary_budget=int(os.getenv("CONTEXT_SUMMARY_BUDGET", "200")),
+    max_messages=int(os.getenv("CONTEXT_MAX_MESSAGES", "40")),
+    cache_size=int(os.getenv("CONTEXT_CACHE_SIZE", "1024"))
+)
+
+# Routes are service functions (see service.py): they take an ApiCall and return
+# a payload, an ApiResult or an EventStream, so the in-process client transport
+# and /api/batch can call them without going through HTTP
+
+# Routes for User Management
+@api_route(app, '/api/user', methods=['POST'])
+def create_user(call):
+    data = call.body
+    # Random ids stay unique across threads and worker processes
+    user_id = data.get('user_id') or f"user_{uuid.uuid4().hex[:12]}"
+    store.create_user(
+        user_id,
+        name=data.get('name', 'Student'),
+        education_level=data.get('education_level', 'Beginner')
+    )
+    return {'user_id': user_id, 'status': 'created'}
+
+@api_route(app, '/api/user/<user_id>', methods=['GET'])
+def get_user(call, user_id):
+    user = store.get_user(user_id)
+    if user is not None:
+        return user
+    return ApiResult({'error': 'User not found'}, 404)
+
+# Routes for Content
+def content_response(call, payload):
+    # Strong ETag over the canonical body; clients revalidate with If-None-Match
+    etag = hashlib.sha1(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+    headers = {'Cache-Control': f"public, max-age={CONTENT_MAX_AGE}"}
+    if call.if_none_match(etag):
+        return not_modified(etag, headers)
+    return ApiResult(payload, headers=dict(headers, ETag=etag_header(etag)))
+
+@api_route(app, '/api/subjects', methods=['GET'])
+def get_subjects(call):
+    return content_response(call, list(content_library.keys()))
+
+@api_route(app, '/api/subjects/<subject>/topics', methods=['GET'])
+def get_topics(call, subject):
+    if subject in content_library:
+        return content_response(call, list(content_library[subject].keys()))
+    return ApiResult({'error': 'Subject not found'}, 404)
+
+@api_route(app, '/api/content/<subject>/<topic>', methods=['GET'])
+def get_content(call, subject, topic):
+    level = call.arg('level', 'beginner')
+    if subject in content_library and topic in content_library[subject]:
+        content = content_library[subject][topic]
+        return content_response(call, {
+            'subject': subject,
+            'topic': topic,
+            'content': content.get(level, content.get('beginner')),
+            'examples': list(content.get('examples', [])),
+            'practice': list(content.get('practice', []))
+        })
+    return ApiResult({'error': 'Content not found'}, 404)
+
+# Chat and AI Interaction
+def admit_chat(call):
+    """Wait for admission; returns a 429 result if the request is turned away"""
+    priority = BATCH if call.header(PRIORITY_HEADER).lower() in ('batch', 'prefetch') else INTERACTIVE
+    try:
+        with CHAT_STAGE_SECONDS.time(stage='admission'):
+            admission.admit(call.body.get('user_id', 'anonymous'), priority)
+    except RateLimited as e:
+        return ApiResult({
+            'error': 'Too many requests',
+            'reason': e.reason,
+            'retry_after': round(e.retry_after, 2)
+        }, 429, {'Retry-After': str(max(1, math.ceil(e.retry_after)))})
+    return None
+
+def start_chat_turn(call):
+    """Record the user's message and work out everything needed to answer it"""
+    with CHAT_STAGE_SECONDS.time(stage='parse'):
+        data = call.body
+        user_id = data.get('user_id', 'anonymous')
+        message = data.get('message', '')
+        subject = data.get('subject', 'General')
+        topic = data.get('topic', '')
+        session_id = data.get('session_id') or f"session_{uuid.uuid4().hex}"
+        budget = LatencyBudget(REQUEST_BUDGET)
+    
+    # The conversation so far, read before this message joins it
+    with CHAT_STAGE_SECONDS.time(stage='context'):
+        context = conversation_context.build(session_id)
     
+    # Store the message in session history
+    with CHAT_STAGE_SECONDS.time(stage='session_append'):
+        store.ensure_session(session_id, user_id, subject, topic)
+        question_seq = store.append_message(session_id, {
+            'role': 'user',
+            'content': message,
+            'timestamp': datetime.now().isoformat()
+        })
+    
+    # Classify locally, only asking Cohere about ambiguous messages
+    with CHAT_STAGE_SECONDS.time(stage='classify'):
+        question_type = classify_question(message, budget)
+    
+    with CHAT_STAGE_SECONDS.time(stage='user_lookup'):
+        user = store.get_user(user_id)
+    education_level = user['education_level'] if user is not None else 'Beginner'
+    
+    # Course material for the prompt, and the whole answer when the library has it
+    with CHAT_STAGE_SECONDS.time(stage='retrieval'):
+        snippets = [
+            snippet for score, snippet in content_index.search(f"{topic} {message}", RETRIEVAL_TOP_K, subject, topic)
+            if score >= RETRIEVAL_MIN_SCORE
+        ]
+        library_answer = content_index.direct_answer(
+            message, subject, topic, question_type, education_level, follow_up=bool(context)
+        ) if LIBRARY_ANSWERS else None
+    return {
+        'user_id': user_id,
+        'message': message,
+        'subject': subject,
+        'topic': topic,
+        'session_id': session_id,
+        'question_seq': question_seq,
+        'question_type': question_type,
+        'education_level': education_level,
+        'use_cache': not data.get('no_cache') and 'no-cache' not in call.header('Cache-Control'),
+        'context': context,
+        'snippets': snippets,
+        'library_answer': library_answer,
+        'max_tokens': GROUNDED_MAX_TOKENS if snippets else MAX_TOKENS,
+        # Answers depend on the conversation and the material, so both are part of the key
+        'cache_key': response_cache.make_key(subject, topic, education_level, question_type, message,
+                                             context=context_text(context) + library_text(snippets)),
+        'budget': budget
+    }
+
+def finish_chat_turn(turn, ai_response, cached):
+    """Store the AI response and update the user's progress"""
     # Store AI response in session history
-    sessions[session_id]['messages'].append({
-        'role': 'ai',
-        'content': ai_response,
-        'timestamp': datetime.now().isoformat(),
-        'question_type': question_type
-    })
+    with CHAT_STAGE_SECONDS.time(stage='session_append'):
+        seq = store.append_message(turn['session_id'], {
+            'role': 'ai',
+            'content': ai_response,
+            'timestamp': datetime.now().isoformat(),
+            'question_type': turn['question_type']
+        })
     
     # Update user progress
-    if user_id in users:
-        if subject not in users[user_id]['progress']:
-            users[user_id]['progress'][subject] = {}
-        if topic not in users[user_id]['progress'][subject]:
-            users[user_id]['progress'][subject][topic] = {
-                'interactions': 0,
-                'last_interaction': None
-            }
-        
-        users[user_id]['progress'][subject][topic]['interactions'] += 1
-        users[user_id]['progress'][subject][topic]['last_interaction'] = datetime.now().isoformat()
+    with CHAT_STAGE_SECONDS.time(stage='progress_update'):
+        store.record_interaction(turn['user_id'], turn['subject'], turn['topic'])
     
-    return jsonify({
+    CHAT_TOKENS.observe(count_tokens(ai_response), kind='response')
+    # The seqs of both stored messages, so clients can page history from them
+    return {
         'response': ai_response,
-        'session_id': session_id,
-        'question_type': question_type
-    })
+        'session_id': turn['session_id'],
+        'question_seq': turn['question_seq'],
+        'seq': seq,
+        'question_type': turn['question_type'],
+        'cached': cached
+    }
 
-@app.route('/api/chat/<session_id>/history', methods=['GET'])
-def get_chat_history(session_id):
-    if session_id in sessions:
-        return jsonify(sessions[session_id])
-    return jsonify({'error': 'Session not found'}), 404
+def turn_prompt(turn):
+    # Only called for prompts that go to the model
+    with CHAT_STAGE_SECONDS.time(stage='prompt_build'):
+        prompt = build_prompt(turn['subject'], turn['topic'], turn['education_level'], turn['question_type'],
+                              turn['message'], turn['context'], turn['snippets'])
+    CHAT_TOKENS.observe(count_tokens(prompt), kind='prompt')
+    return prompt
 
-# Progress Tracking
-@app.route('/api/progress/<user_id>', methods=['GET'])
-def get_progress(user_id):
-    if user_id in users:
-        # Calculate overall progress
-        progress_data = users[user_id]['progress']
-        subjects = progress_data.keys()
+def cached_answer(turn):
+    with CHAT_STAGE_SECONDS.time(stage='cache_lookup'):
+        return response_cache.get(turn['cache_key']) if turn['use_cache'] else None
+
+def use_fallback(turn, error):
+    print(f"Cohere generation error: {error}")
+    CHAT_FALLBACKS.inc(reason=type(error).__name__)
+    return fallback_response(turn['question_type'], turn['subject'], turn['topic'])
+
+def generate_cached(turn):
+    """Generate and cache a response, sharing any identical in-flight generation
+
+    Requests for a fresh answer generate their own rather than joining one.
+    """
+    def generate():
+        ai_response = generate_response(turn_prompt(turn), turn['budget'], turn['max_tokens'])
+        response_cache.set(turn['cache_key'], ai_response)
+        return ai_response
+
+    if not turn['use_cache']:
+        return generate()
+    ai_response, _ = generation_flight.do(turn['cache_key'], generate)
+    return ai_response
+
+@api_route(app, '/api/chat/message', methods=['POST'])
+@profiled
+def process_message(call):
+    rejected = admit_chat(call)
+    if rejected:
+        return rejected
+    turn = start_chat_turn(call)
+    
+    if turn['library_answer'] is not None:
+        CHAT_RESPONSES.inc(source='library')
+        return finish_chat_turn(turn, turn['library_answer'], False)
+    
+    # Generate response based on question type and context, reusing a cached
+    # answer unless the client asked for a fresh one
+    ai_response = cached_answer(turn)
+    cached = ai_response is not None
+    
+    if cached:
+        CHAT_RESPONSES.inc(source='cache')
+    else:
+        try:
+            with CHAT_STAGE_SECONDS.time(stage='generate'):
+                ai_response = generate_cached(turn)
+            CHAT_RESPONSES.inc(source='model')
+        except Exception as e:
+            # Fallback responses if Cohere API fails
+            ai_response = use_fallback(turn, e)
+            CHAT_RESPONSES.inc(source='fallback')
+    
+    return finish_chat_turn(turn, ai_response, cached)
+
+@api_route(app, '/api/chat/message/stream', methods=['POST'])
+def stream_message(call):
+    rejected = admit_chat(call)
+    if rejected:
+        return rejected
+    turn = start_chat_turn(call)
+    
+    def events():
+        if turn['library_answer'] is not None:
+            CHAT_RESPONSES.inc(source='library')
+            yield {'token': turn['library_answer']}, None
+            yield finish_chat_turn(turn, turn['library_answer'], False), 'done'
+            return
         
-        subject_progress = {}
-        total_interactions = 0
-        topics_touched = 0
+        ai_response = cached_answer(turn)
+        cached = ai_response is not None
         
-        for subject in subjects:
-            topics = progress_data[subject].keys()
-            subject_interactions = 0
-            subject_topics = len(topics)
-            topics_touched += subject_topics
-            
-            for topic in topics:
-                topic_interactions = progress_data[subject][topic]['interactions']
-                subject_interactions += topic_interactions
-                total_interactions += topic_interactions
-            
-            # Simple progress calculation - can be more sophisticated
-            progress_percentage = min(100, subject_interactions * 5)  # 5% per interaction, max 100%
-            subject_progress[subject] = progress_percentage
+        if cached:
+            CHAT_RESPONSES.inc(source='cache')
+            yield {'token': ai_response}, None
+        else:
+            chunks = []
+            # Generation time includes the client reading the stream
+            start = time.perf_counter()
+            try:
+                for token in stream_response(turn_prompt(turn), turn['budget'], turn['max_tokens']):
+                    chunks.append(token)
+                    yield {'token': token}, None
+                ai_response = ''.join(chunks).strip()
+                response_cache.set(turn['cache_key'], ai_response)
+                CHAT_RESPONSES.inc(source='model')
+            except Exception as e:
+                fallback = use_fallback(turn, e)
+                # Keep whatever already reached the client, otherwise send the fallback
+                if chunks:
+                    ai_response = ''.join(chunks).strip()
+                    CHAT_RESPONSES.inc(source='model')
+                else:
+                    ai_response = fallback
+                    CHAT_RESPONSES.inc(source='fallback')
+                    yield {'token': fallback}, None
+            CHAT_STAGE_SECONDS.observe(time.perf_counter() - start, stage='generate')
+        
+        yield finish_chat_turn(turn, ai_response, cached), 'done'
+    
+    return EventStream(events())
+
+@api_route(app, '/api/chat/<session_id>/history', methods=['GET'])
+def get_chat_history(call, session_id):
+    last_seq = store.last_seq(session_id)
+    if last_seq is None:
+        return ApiResult({'error': 'Session not found'}, 404)
+    
+    since = call.arg('since', 0, type=int)
+    limit = call.arg('limit', type=int)
+    before = call.arg('before', type=int)
+    if before is None and call.arg('tail'):
+        before = last_seq + 1
+    if before is not None:
+        # Page backwards: the `limit` newest messages older than `before`
+        session = store.get_session(session_id, since=since, limit=limit + 1 if limit else None, before=before)
+        has_earlier = bool(limit) and len(session['messages']) > limit
+        if has_earlier:
+            session['messages'] = session['messages'][1:]
+        session.update({
+            'session_id': session_id,
+            'last_seq': last_seq,
+            'before': session['messages'][0]['seq'] if session['messages'] else before,
+            'has_earlier': has_earlier
+        })
+        return session
+    
+    # The newest seq identifies the history; clients that already have it get a 304
+    etag = f"{session_id}:{last_seq}"
+    if call.if_none_match(etag):
+        return not_modified(etag)
+    
+    session = store.get_session(session_id, since=since, limit=limit)
+    next_since = session['messages'][-1]['seq'] if session['messages'] else since
+    session.update({
+        'session_id': session_id,
+        'last_seq': last_seq,
+        'next_since': next_since,
+        'has_more': next_since < last_seq
+    })
+    
+    return ApiResult(session, headers={'ETag': etag_header(etag)})
+
+# Progress Tracking
+@api_route(app, '/api/progress/<user_id>', methods=['GET'])
+def get_progress(call, user_id):
+    # Totals are maintained as interactions are recorded, so no re-summing here
+    aggregates = store.get_aggregates(user_id)
+    if aggregates is not None:
+        # Simple progress calculation - can be more sophisticated
+        subject_progress = {
+            subject: min(100, totals['interactions'] * 5)  # 5% per interaction, max 100%
+            for subject, totals in aggregates['subjects'].items()
+        }
         
-        return jsonify({
+        return {
             'user_id': user_id,
-            'total_interactions': total_interactions,
-            'topics_touched': topics_touched,
+            'total_interactions': aggregates['interactions'],
+            'topics_touched': aggregates['topics_touched'],
+            'last_interaction': aggregates['last_interaction'],
             'subject_progress': subject_progress,
-            'overall_progress': min(100, total_interactions * 2)  # 2% per interaction, max 100%
-        })
+            'overall_progress': min(100, aggregates['interactions'] * 2)  # 2% per interaction, max 100%
+        }
+    
+    return ApiResult({'error': 'User not found'}, 404)
+
+@api_route(app, '/api/analytics/cohort', methods=['GET'])
+@profiled
+def get_cohort_analytics(call):
+    snapshot = cohort_analytics.snapshot(education_level=call.arg('education_level') or None)
+    return snapshot.report(
+        offset=max(0, call.arg('offset', 0, type=int)),
+        limit=min(500, max(1, call.arg('limit', 50, type=int))),
+        top=min(100, max(1, call.arg('top', 10, type=int))),
+        bins=min(100, max(1, call.arg('bins', 10, type=int)))
+    )
+
+# Batch execution of several API calls in one round trip
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+batch_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BATCH_WORKERS", "8")))
+
+def run_sub_request(item):
+    method = str(item.get('method', 'GET')).upper()
+    path = item.get('path', '')
+    if not path.startswith('/api/') or path.startswith('/api/batch') or path.endswith('/stream'):
+        return {'status': 400, 'body': {'error': f"Path not allowed in a batch: {path}"}}
+    
+    # Dispatch to the route's service so each item behaves exactly like its own request
+    params = {k: str(v) for k, v in (item.get('params') or {}).items()}
+    body = item.get('body') if method != 'GET' else None
+    # Batched chat is bulk work and queues behind interactive requests
+    headers = dict(item.get('headers') or {})
+    if not any(name.lower() == PRIORITY_HEADER.lower() for name in headers):
+        headers[PRIORITY_HEADER] = 'batch'
+    response = dispatch(app, method, path, params, body, headers)
+    result = {'status': response.status, 'body': response.body}
+    if response.headers.get('ETag'):
+        result['etag'] = response.headers['ETag']
+    return result
+
+@api_route(app, '/api/batch', methods=['POST'])
+def batch(call):
+    items = call.body.get('requests')
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return ApiResult({'error': "Expected {'requests': [{'method', 'path', 'params', 'body'}, ...]}"}, 400)
+    if len(items) > BATCH_MAX_ITEMS:
+        return ApiResult({'error': f"At most {BATCH_MAX_ITEMS} requests per batch"}, 413)
+    
+    # Runs of consecutive reads execute in parallel; writes run alone, in order
+    results = [None] * len(items)
+    reads = []
+    
+    def run_reads():
+        for index, result in zip(reads, batch_executor.map(run_sub_request, [items[i] for i in reads])):
+            results[index] = result
+        reads.clear()
+    
+    for index, item in enumerate(items):
+        if str(item.get('method', 'GET')).upper() == 'GET':
+            reads.append(index)
+        else:
+            run_reads()
+            results[index] = run_sub_request(item)
+    run_reads()
     
-    return jsonify({'error': 'User not found'}), 404
+    return {'responses': [
+        dict(result, id=item.get('id', index))
+        for index, (item, result) in enumerate(zip(items, results))
+    ]}
+
+# Health
+def store_health():
+    try:
+        return {'status': 'ok', 'backend': type(store).__name__, 'users': store.count_users()}
+    except Exception as e:
+        return {'status': 'error', 'backend': type(store).__name__, 'error': str(e)}
+
+@api_route(app, '/api/health', methods=['GET'])
+def get_health(call):
+    # Ready when the store answers and a model key is configured; failing model
+    # calls only degrade the service, since chat falls back to canned responses
+    store_status = store_health()
+    upstream = dict(upstream_health.status(), configured=bool(cohere_api_key), circuits={
+        breaker.name: breaker.stats() for breaker in (classify_breaker, generate_breaker)
+    })
+    if any(circuit['state'] != 'closed' for circuit in upstream['circuits'].values()):
+        upstream['status'] = 'degraded'
+    ready = store_status['status'] == 'ok' and upstream['configured']
+    if not ready:
+        status = 'unavailable'
+    elif upstream['status'] == 'degraded':
+        status = 'degraded'
+    else:
+        status = 'ok'
+    return ApiResult({
+        'status': status,
+        'ready': ready,
+        'store': store_status,
+        'upstream': upstream,
+        'uptime_seconds': round(time.time() - started_at, 1)
+    }, 200 if ready else 503, {'Cache-Control': 'no-store'})
+
+# Metrics
+@registry.collector
+def runtime_metrics():
+    stats = admission.stats()
+    lines = render_samples('tutor_admission_queue_depth', 'Chat requests waiting for admission',
+                           [((), stats['queue_depth'])])
+    lines += render_samples('tutor_admission_admitted_total', 'Chat requests admitted, by priority',
+                            [((name,), n) for name, n in stats['admitted'].items()], ('priority',), 'counter')
+    lines += render_samples('tutor_admission_rejected_total', 'Chat requests turned away with 429, by reason',
+                            [((reason,), n) for reason, n in stats['rejected'].items()], ('reason',), 'counter')
+    lines += render_samples('tutor_circuit_open', '1 while an upstream circuit is not closed',
+                            [((b.name,), int(b.state != 'closed')) for b in (classify_breaker, generate_breaker)],
+                            ('operation',))
+    lines += render_samples('tutor_response_cache_entries', 'Cached chat responses',
+                            [((), response_cache.stats().get('size', 0))])
+    return lines
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Plain Flask route: Prometheus scrapes text, so there is no service behind it
+    return Response(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Admin. None of these endpoints authenticate; keep /api/admin off public networks,
+# the profiles in particular expose stack traces of the code serving requests
+@api_route(app, '/api/admin/profiles', methods=['GET'])
+def list_profiles(call):
+    return {'enabled': PROFILING_ENABLED, 'profiles': profiles.list()}
+
+@api_route(app, '/api/admin/profiles/<profile_id>', methods=['GET'])
+def get_profile(call, profile_id):
+    profile = profiles.get(profile_id)
+    if profile is None:
+        return ApiResult({'error': 'Profile not found'}, 404)
+    return profile
+
+@api_route(app, '/api/admin/classifier', methods=['GET'])
+def get_classifier_stats(call):
+    stats = question_classifier.stats()
+    stats['batcher'] = classify_batcher.stats()
+    return stats
+
+@api_route(app, '/api/admin/admission', methods=['GET'])
+def get_admission_stats(call):
+    return admission.stats()
+
+@api_route(app, '/api/admin/memory', methods=['GET'])
+def get_memory_stats(call):
+    return store.memory_stats()
+
+@api_route(app, '/api/admin/progress/verify', methods=['GET', 'POST'])
+def verify_progress(call):
+    # GET checks the running aggregates against a full recompute, POST also repairs them
+    mismatched = store.verify_aggregates(rebuild=call.method == 'POST')
+    return {'consistent': not mismatched, 'mismatched': mismatched, 'rebuilt': call.method == 'POST'}
+
+@api_route(app, '/api/admin/retrieval', methods=['GET'])
+def search_content(call):
+    # Index statistics, plus the ranked snippets for `q` to check what a question retrieves
+    result = {'stats': content_index.stats()}
+    query = call.arg('q')
+    if query:
+        result['results'] = [
+            {'score': score, 'subject': snippet.subject, 'topic': snippet.topic, 'kind': snippet.kind, 'text': snippet.text}
+            for score, snippet in content_index.search(
+                query, min(20, max(1, call.arg('k', RETRIEVAL_TOP_K, type=int))), call.arg('subject'), call.arg('topic')
+            )
+        ]
+    return result
+
+@api_route(app, '/api/admin/cache', methods=['GET'])
+def get_cache_stats(call):
+    return {
+        'stats': response_cache.stats(),
+        'singleflight': generation_flight.stats(),
+        'context': conversation_context.stats(),
+        'entries': response_cache.entries()
+    }
+
+@api_route(app, '/api/admin/cache', methods=['DELETE'])
+def flush_cache(call):
+    return {'status': 'flushed', 'removed': response_cache.flush()}
 
 if __name__ == '__main__':
+    # Development server; see gunicorn.conf.py for running several worker processes
     app.run(debug=True, port=5000)
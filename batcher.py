@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Collect items from concurrent callers and process them in small batches
+
+    A background thread waits for the first item, then keeps collecting for up
+    to `window` seconds or until `max_batch` items are queued, and hands the
+    whole batch to `fn`. `fn` must return one result per item, in order.
+    """
+
+    def __init__(self, fn, max_batch=32, window=0.01):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.window = window
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.largest_batch = 0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                    self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Queue an item and block until its batch has been processed"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+                if len(results) != len(items):
+                    raise ValueError(f"Batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                with self._lock:
+                    self.batches += 1
+                    self.items += len(items)
+                    self.largest_batch = max(self.largest_batch, len(items))
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "window_ms": self.window * 1000,
+                "pending": self._queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "largest_batch": self.largest_batch,
+                "average_batch": self.items / self.batches if self.batches else 0.0,
+            }
@@ -0,0 +1,258 @@
+"""Load-testing benchmark for the backend
+
+Drives a mixed workload of chat messages, history reads and progress reads
+from many virtual users through TutorAPIClient for a fixed time, then reports
+throughput and p50/p95/p99 latency per operation and saves them as JSON:
+
+    python benchmark.py --fake-cohere --users 16 --duration 30
+    python benchmark.py --fake-cohere --compare benchmarks/<older commit>.json
+
+--fake-cohere starts fake_cohere.py in this process and runs the backend in
+process against it (TUTOR_TRANSPORT=inprocess), so nothing leaves the
+machine. Without it the client talks to TUTOR_API_URL as usual; start that
+backend with COHERE_API_URL pointing at `python fake_cohere.py`, and with
+RATE_LIMIT_USER_PER_MIN=0 RATE_LIMIT_GLOBAL_PER_SEC=0 unless admission
+control is what you are measuring.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+SUBJECTS = [("Mathematics", "Algebra"), ("Mathematics", "Calculus"), ("Physics", "Mechanics"),
+            ("Computer Science", "Algorithms")]
+QUESTIONS = [
+    "Can you explain {topic} to me?",
+    "Give me an example of {topic}",
+    "What is the definition of {topic}?",
+    "How do I solve a {topic} problem step by step?",
+    "Give me a practice exercise on {topic}",
+    "Why does {topic} work the way it does? I'm confused about question {n}",
+]
+DEFAULT_MIX = "chat=50,history=30,progress=20"
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}; choose from {', '.join(OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def chat(client, rng, args):
+    subject, topic = rng.choice(SUBJECTS)
+    question = rng.choice(QUESTIONS).format(topic=topic, n=rng.randrange(1000))
+    return client.send_message(question, subject, topic, fresh=rng.random() < args.fresh)
+
+
+def history(client, rng, args):
+    return client.get_chat_history()
+
+
+def progress(client, rng, args):
+    return client.get_progress()
+
+
+def earlier(client, rng, args):
+    return client.get_earlier_messages(limit=20)
+
+
+OPERATIONS = {"chat": chat, "history": history, "progress": progress, "earlier": earlier}
+
+
+def failed(result):
+    return isinstance(result, dict) and "error" in result
+
+
+def percentile(ordered, q):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "throughput_rps": round(len(ordered) / seconds, 2) if seconds else None,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else None,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else None
+    }
+
+
+class Recorder:
+    """Latencies per operation, ignoring anything finished during warmup"""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, error, finished_at):
+        if finished_at < self.measure_from:
+            return
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            self.errors[operation] += int(error)
+
+
+def virtual_user(index, base_client, user_id, args, mix, recorder, deadline):
+    client = base_client.clone()
+    client.user_id = user_id
+    rng = random.Random(args.seed * 1000 + index)
+    names, weights = list(mix), list(mix.values())
+    # Give history and progress reads something to return from the start
+    chat(client, rng, args)
+    while time.perf_counter() < deadline:
+        operation = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            error = failed(OPERATIONS[operation](client, rng, args))
+        except Exception:
+            error = True
+        finished_at = time.perf_counter()
+        recorder.record(operation, finished_at - start, error, finished_at)
+        if args.think_ms:
+            time.sleep(rng.expovariate(1000 / args.think_ms))
+
+
+def git_commit():
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(result, baseline):
+    """Print how each operation moved against an earlier run"""
+    print(f"\nAgainst {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    print(f"{'operation':<10} {'metric':<15} {'baseline':>10} {'now':>10} {'change':>9}")
+    for operation, now in sorted(dict(result["operations"], overall=result["overall"]).items()):
+        before = baseline.get("overall") if operation == "overall" else baseline.get("operations", {}).get(operation)
+        if not before:
+            continue
+        for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms"):
+            old, new = before.get(metric), now.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"{operation:<10} {metric:<15} {old:>10} {new:>10} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"operation weights (default {DEFAULT_MIX})")
+    parser.add_argument("--fresh", type=float, default=0.3, help="share of chat messages that bypass the response cache")
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between a user's requests")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fake-cohere", action="store_true", help="run the backend in process against fake_cohere.py")
+    parser.add_argument("--name", default="", help="label stored with the results")
+    parser.add_argument("--output", help="results file (default benchmarks/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    # One pooled connection per virtual user
+    os.environ.setdefault("TUTOR_API_POOL_SIZE", str(args.users))
+    fake = None
+    if args.fake_cohere:
+        from fake_cohere import start_server
+        fake = start_server()
+        os.environ["COHERE_API_URL"] = fake.url
+        os.environ.setdefault("COHERE_API_KEY", "fake")
+        os.environ["TUTOR_TRANSPORT"] = "inprocess"
+        # Measure the pipeline, not the rate limiter
+        os.environ.setdefault("RATE_LIMIT_USER_PER_MIN", "0")
+        os.environ.setdefault("RATE_LIMIT_GLOBAL_PER_SEC", "0")
+    # Imported here so the settings above reach the client and in-process backend
+    from api_client import api_client
+
+    setup = [api_client.clone().create_user(f"Bench {i}", "Undergraduate") for i in range(args.users)]
+    user_ids = [user.get("user_id") for user in setup]
+    if None in user_ids:
+        print(f"Could not create users: {setup[0]}", file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    recorder = Recorder(measure_from=start + args.warmup)
+    deadline = start + args.warmup + args.duration
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for future in [pool.submit(virtual_user, i, api_client, user_ids[i], args, args.mix, recorder, deadline)
+                       for i in range(args.users)]:
+            future.result()
+    seconds = time.perf_counter() - recorder.measure_from
+
+    commit = git_commit()
+    everything = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    result = {
+        "name": args.name,
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "users": args.users,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "mix": args.mix,
+            "fresh": args.fresh,
+            "think_ms": args.think_ms,
+            "seed": args.seed,
+            "transport": "inprocess" if args.fake_cohere else os.getenv("TUTOR_TRANSPORT", "http"),
+            "target": None if args.fake_cohere else api_client.base_url
+        },
+        "fake_cohere": fake.config.describe() if fake else None,
+        # Fallback answers look like successes to the client; the circuits and
+        # upstream failure counts here show how many there were
+        "health": api_client.health(),
+        "overall": summarize(everything, sum(recorder.errors.values()), seconds),
+        "operations": {
+            operation: summarize(latencies, recorder.errors[operation], seconds)
+            for operation, latencies in sorted(recorder.latencies.items())
+        }
+    }
+    if fake:
+        result["fake_cohere"]["calls"] = dict(fake.calls)
+        fake.shutdown()
+
+    output = args.output or os.path.join("benchmarks", f"{commit}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(json.dumps({"overall": result["overall"], "operations": result["operations"]}, indent=2))
+    print(f"Saved to {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import itertools
+import threading
+import time
+from collections import deque
+
+import api_models as models
+from api_client import StreamInterrupted
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+
+FAILED_RESPONSE = "I'm sorry, I'm having trouble connecting to my knowledge base. Please try again later."
+
+
+class ChatJob:
+    """One chat submission and its progress, updated by a worker thread"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, question, subject, topic):
+        self.id = next(self._ids)
+        self.question = question
+        self.subject = subject
+        self.topic = topic
+        self.status = QUEUED
+        self.partial = ""
+        self.response = None
+        # History seqs of the stored question and answer, when the backend reported them
+        self.question_seq = None
+        self.response_seq = None
+        # Whether the backend saw the question; a job cancelled while queued never reaches it
+        self.started = False
+        self.submitted_at = time.time()
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, CANCELLED)
+
+
+class ChatJobQueue:
+    """Runs one chat session's submissions in the background, in order
+
+    Jobs share a thread pool with every other session but a session's jobs run
+    one at a time, so the backend sees its turns in submission order. Workers
+    only update the job objects; the UI polls them.
+    """
+
+    def __init__(self, client, executor):
+        self.client = client
+        self.executor = executor
+        self._jobs = []
+        self._queued = deque()
+        self._running = False
+        self._lock = threading.Lock()
+
+    def submit(self, question, subject, topic=""):
+        job = ChatJob(question, subject, topic)
+        with self._lock:
+            self._jobs.append(job)
+            self._queued.append(job)
+            if not self._running:
+                self._running = True
+                self.executor.submit(self._drain)
+        return job
+
+    def cancel(self, job_id):
+        """Drop a queued job or stop a running one; its partial answer is discarded"""
+        with self._lock:
+            for job in self._jobs:
+                if job.id == job_id and not job.finished:
+                    job._cancel.set()
+                    if job.status == QUEUED:
+                        self._queued.remove(job)
+                        job.status = CANCELLED
+                    return True
+        return False
+
+    def jobs(self):
+        """Submitted jobs that have not been collected yet, oldest first"""
+        with self._lock:
+            return list(self._jobs)
+
+    def collect_finished(self):
+        """Remove and return the finished jobs at the head of the queue, keeping order"""
+        with self._lock:
+            finished = []
+            while self._jobs and self._jobs[0].finished:
+                finished.append(self._jobs.pop(0))
+            return finished
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queued:
+                    self._running = False
+                    return
+                job = self._queued.popleft()
+                job.status = RUNNING
+            try:
+                job.response = self._run(job)
+            except Exception as e:
+                print(f"Chat job {job.id} failed: {e}")
+                job.response = None if job.cancelled else job.partial or FAILED_RESPONSE
+            # A cancelled job has no answer; one that finished before the cancel keeps it
+            job.status = DONE if job.response is not None else CANCELLED
+
+    def _run(self, job):
+        # Stream the answer into job.partial, falling back to the blocking
+        # endpoint only if the stream failed before the backend answered:
+        # after that it has stored the question, and resending would repeat the turn
+        job.started = True
+        events = self.client.stream_message(job.question, job.subject, job.topic)
+        try:
+            for event in events:
+                if job.cancelled:
+                    return None
+                if event.get("done"):
+                    job.question_seq, job.response_seq = event.get("question_seq"), event.get("seq")
+                    return event.get("response", job.partial)
+                job.partial += event.get("token", "")
+            return job.partial or models.CHAT_UNAVAILABLE
+        except StreamInterrupted:
+            # Fails the job, keeping any partial answer
+            raise
+        except Exception:
+            if job.cancelled:
+                return None
+            response = self.client.send_message(job.question, job.subject, job.topic)
+            job.question_seq, job.response_seq = response.get("question_seq"), response.get("seq")
+            return response.get("response", models.CHAT_UNAVAILABLE)
+        finally:
+            # Closing the stream early tells the backend to stop generating
+            events.close()
@@ -0,0 +1,142 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+
+class BudgetExceeded(TimeoutError):
+    """The request's latency budget ran out before the upstream answered"""
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one upstream operation
+
+    The outcomes of the last `window` calls are kept; once at least
+    `min_calls` of them are recorded and the share of failures (errors, and
+    calls slower than `slow_call_seconds`) reaches `failure_rate`, the circuit
+    opens and calls fail fast with CircuitOpenError. After `open_seconds` it
+    half-opens and lets `half_open_calls` probes through: a successful probe
+    closes it again, a failed one reopens it.
+    """
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, open_seconds=30,
+                 slow_call_seconds=None, half_open_calls=1):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self.transitions = 0
+        self._outcomes = deque(maxlen=window)
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        self.state = state
+        self.transitions += 1
+        if state == OPEN:
+            self.opened_at = time.time()
+        self._probes = 0
+        if state != OPEN:
+            self._outcomes.clear()
+
+    def allow(self):
+        """Whether a call may go upstream now; counts a probe when half-open"""
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.open_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok, seconds=None):
+        if ok and self.slow_call_seconds is not None and seconds is not None and seconds > self.slow_call_seconds:
+            ok = False
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(CLOSED if ok else OPEN)
+                return
+            self._outcomes.append(ok)
+            failures = self._outcomes.count(False)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures / len(self._outcomes) >= self.failure_rate):
+                self._transition(OPEN)
+
+    @contextmanager
+    def guard(self):
+        """Run the block as one upstream call, or raise CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError(f"{self.name} circuit is open")
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.record(False)
+            raise
+        else:
+            self.record(True, time.monotonic() - start)
+
+    def stats(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                "state": self.state,
+                "recent_calls": len(outcomes),
+                "recent_failures": outcomes.count(False),
+                "opened_at": self.opened_at,
+                "rejected": self.rejected,
+                "transitions": self.transitions
+            }
+
+
+# Upstream calls run here so a request can stop waiting when its budget is spent
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="upstream")
+
+
+class LatencyBudget:
+    """Time one request may spend waiting on upstream calls, shared across them"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds if seconds else None
+
+    def remaining(self, cap=None):
+        """Seconds left (None if unlimited), at most `cap`"""
+        if self.deadline is None:
+            return cap
+        left = max(0.0, self.deadline - time.monotonic())
+        return left if cap is None else min(left, cap)
+
+    def run(self, fn, *args, cap=None):
+        """Call fn(*args), giving up with BudgetExceeded when the budget runs out
+
+        The call itself is not interrupted; it finishes in the background and
+        its result is dropped.
+        """
+        timeout = self.remaining(cap)
+        if timeout is None:
+            return fn(*args)
+        if timeout <= 0:
+            raise BudgetExceeded("latency budget exhausted")
+        future = _executor.submit(fn, *args)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            raise BudgetExceeded(f"no answer within {timeout:.2f}s") from None
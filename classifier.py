@@ -0,0 +1,132 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+# Extra labelled questions used only by the local model, on top of the
+# examples the backend sends to co.classify
+SEED_EXAMPLES = [
+    {"text": "Explain why the sky is blue", "label": "explanation"},
+    {"text": "Can you explain this in more detail?", "label": "explanation"},
+    {"text": "Why does this work?", "label": "explanation"},
+    {"text": "Help me understand recursion", "label": "explanation"},
+    {"text": "Can you give me an example?", "label": "example"},
+    {"text": "Show me an example of a for loop", "label": "example"},
+    {"text": "What is an example of a chemical reaction?", "label": "example"},
+    {"text": "Give me a practice problem to solve.", "label": "practice"},
+    {"text": "Can I have some exercises on fractions?", "label": "practice"},
+    {"text": "Quiz me on the laws of motion", "label": "practice"},
+    {"text": "Define momentum", "label": "definition"},
+    {"text": "What does the term entropy mean?", "label": "definition"},
+    {"text": "What is the meaning of a prime number?", "label": "definition"},
+    {"text": "How do I solve a system of linear equations?", "label": "how-to"},
+    {"text": "What are the steps to reverse a linked list?", "label": "how-to"},
+    {"text": "How can I find the slope of a line?", "label": "how-to"},
+]
+
+TOKEN_RE = re.compile(r"[a-z0-9']+")
+
+
+def tokenize(text):
+    """Lower-cased unigrams plus bigrams"""
+    words = TOKEN_RE.findall(text.lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def load_training_file(path):
+    """Load labelled examples from a JSON list or JSON-lines file"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        raw = f.read().strip()
+    if not raw:
+        return []
+    if raw.startswith("["):
+        rows = json.loads(raw)
+    else:
+        rows = [json.loads(line) for line in raw.splitlines() if line.strip()]
+    return [
+        {"text": row["text"], "label": row["label"]}
+        for row in rows
+        if row.get("text") and row.get("label")
+    ]
+
+
+class LocalQuestionClassifier:
+    """Multinomial naive Bayes question-type classifier trained once at startup"""
+
+    def __init__(self, examples, threshold=0.75, alpha=0.5):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.labels = []
+        self.log_priors = {}
+        self.log_likelihoods = {}
+        self.unseen_log_likelihood = {}
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self.train(examples)
+
+    def train(self, examples):
+        """Fit label priors and per-token log likelihoods"""
+        label_counts = Counter()
+        token_counts = defaultdict(Counter)
+        for example in examples:
+            label_counts[example["label"]] += 1
+            token_counts[example["label"]].update(tokenize(example["text"]))
+
+        vocabulary = set()
+        for counts in token_counts.values():
+            vocabulary.update(counts)
+        vocab_size = len(vocabulary) or 1
+        total = sum(label_counts.values()) or 1
+
+        self.labels = sorted(label_counts)
+        self.log_priors = {label: math.log(label_counts[label] / total) for label in self.labels}
+        self.log_likelihoods = {}
+        self.unseen_log_likelihood = {}
+        for label in self.labels:
+            denominator = sum(token_counts[label].values()) + self.alpha * vocab_size
+            self.unseen_log_likelihood[label] = math.log(self.alpha / denominator)
+            self.log_likelihoods[label] = {
+                token: math.log((count + self.alpha) / denominator)
+                for token, count in token_counts[label].items()
+            }
+        self.vocabulary = vocabulary
+
+    def predict(self, text):
+        """Return (label, confidence) for a message"""
+        if not self.labels:
+            return None, 0.0
+        tokens = [token for token in tokenize(text) if token in self.vocabulary]
+        scores = {}
+        for label in self.labels:
+            likelihoods = self.log_likelihoods[label]
+            unseen = self.unseen_log_likelihood[label]
+            scores[label] = self.log_priors[label] + sum(likelihoods.get(token, unseen) for token in tokens)
+
+        best = max(scores, key=scores.get)
+        # Softmax over the log scores gives the posterior of the best label
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1.0 / normalizer
+
+    def is_confident(self, confidence):
+        return confidence >= self.threshold
+
+    def record(self, outcome):
+        """Count how a message was classified (local, remote, remote_error, ...)"""
+        with self._lock:
+            self.counters[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        total = counters.get("local", 0) + counters.get("remote", 0)
+        return {
+            "labels": self.labels,
+            "vocabulary_size": len(self.vocabulary),
+            "threshold": self.threshold,
+            "counters": counters,
+            "remote_rate": counters.get("remote", 0) / total if total else 0.0,
+        }
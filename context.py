@@ -0,0 +1,141 @@
+import re
+import threading
+from collections import OrderedDict
+
+from metrics import count_tokens
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+ROLE_NAMES = {'user': 'Student', 'ai': 'Tutor'}
+
+
+def clip(text, max_tokens):
+    """The first sentence of `text`, cut to about `max_tokens` tokens"""
+    text = " ".join(str(text or "").split())
+    first = SENTENCE_END_RE.split(text, 1)[0]
+    words = first.split()
+    while words and count_tokens(" ".join(words)) > max_tokens:
+        words = words[:max(1, len(words) * 3 // 4)] if len(words) > 1 else []
+    clipped = " ".join(words)
+    return clipped if clipped == text else clipped + " ..."
+
+
+def summary_line(message, max_tokens):
+    verb = 'asked' if message['role'] == 'user' else 'explained'
+    return f"{ROLE_NAMES.get(message['role'], message['role'])} {verb}: {clip(message['content'], max_tokens)}"
+
+
+class ConversationContext:
+    """Recent turns of a session packed into a token budget, plus a rolling summary
+
+    The newest messages are kept verbatim until `token_budget` is used up.
+    Older ones are folded into a summary of one short line per message,
+    at most `summary_budget` tokens with the oldest lines dropped first. The
+    summary is cached per session with the seq it covers up to, so a request
+    only summarizes the messages that left the window since the last one.
+    """
+
+    def __init__(self, store, token_budget=600, summary_budget=200, max_messages=40, line_tokens=30,
+                 cache_size=1024):
+        self.store = store
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        self.max_messages = max_messages
+        self.line_tokens = line_tokens
+        self.cache_size = cache_size
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.folded = 0
+
+    def build(self, session_id):
+        """{'summary', 'turns', 'tokens'} for the session's messages so far, or None if it has none"""
+        if self.token_budget <= 0:
+            return None
+        last_seq = self.store.last_seq(session_id)
+        if not last_seq:
+            return None
+        session = self.store.get_session(session_id, limit=self.max_messages, before=last_seq + 1)
+        messages = session['messages'] if session else []
+        if not messages:
+            return None
+
+        # Newest first until the budget is spent
+        turns = []
+        used = 0
+        for message in reversed(messages):
+            line = f"{ROLE_NAMES.get(message['role'], message['role'])}: {message['content']}"
+            tokens = count_tokens(line)
+            if used + tokens > self.token_budget:
+                if not turns:
+                    # A single long message still goes in, shortened
+                    line = f"{ROLE_NAMES.get(message['role'], message['role'])}: {clip(message['content'], self.token_budget)}"
+                    turns.append((message['seq'], line))
+                    used += count_tokens(line)
+                break
+            turns.append((message['seq'], line))
+            used += tokens
+        turns.reverse()
+
+        summary = self._summary(session_id, turns[0][0], messages)
+        return {
+            'summary': summary,
+            'turns': [line for _, line in turns],
+            'tokens': used + count_tokens(summary)
+        }
+
+    def _summary(self, session_id, window_start, fetched):
+        with self._lock:
+            entry = self._summaries.get(session_id)
+            if entry is not None:
+                self._summaries.move_to_end(session_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+            upto, lines = (entry['upto'], list(entry['lines'])) if entry else (0, [])
+
+        if window_start > upto:
+            # Messages that left the window since the summary was last updated
+            if len(fetched) < self.max_messages or fetched[0]['seq'] <= upto + 1:
+                delta = [m for m in fetched if upto < m['seq'] < window_start]
+            else:
+                session = self.store.get_session(session_id, since=upto, limit=self.max_messages, before=window_start)
+                delta = session['messages'] if session else []
+            for message in delta:
+                text = summary_line(message, self.line_tokens)
+                lines.append((message['seq'], text, count_tokens(text)))
+            self.folded += len(delta)
+            # Keep twice the budget so a window that grows back still has lines to show
+            total = sum(tokens for _, _, tokens in lines)
+            while lines and total > 2 * self.summary_budget:
+                total -= lines.pop(0)[2]
+            upto = window_start - 1
+            with self._lock:
+                self._summaries[session_id] = {'upto': upto, 'lines': lines}
+                self._summaries.move_to_end(session_id)
+                while len(self._summaries) > self.cache_size:
+                    self._summaries.popitem(last=False)
+
+        # The newest lines older than the window that fit the summary budget
+        shown = []
+        used = 0
+        for seq, text, tokens in reversed(lines):
+            if seq >= window_start:
+                continue
+            if used + tokens > self.summary_budget:
+                break
+            shown.append(text)
+            used += tokens
+        return "\n".join(reversed(shown))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._summaries),
+                'max_sessions': self.cache_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'folded_messages': self.folded,
+                'token_budget': self.token_budget,
+                'summary_budget': self.summary_budget
+            }
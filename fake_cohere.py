@@ -0,0 +1,274 @@
+"""Local stand-in for the Cohere API, for benchmarks and offline development
+
+Serves /v1/generate (plain and streamed) and /v1/classify in the wire format
+of the Cohere SDK, with configurable latency, failure rate and output length,
+so the backend runs its real client code against it:
+
+    python fake_cohere.py --port 5055 --latency lognormal:400:0.5 --error-rate 0.02
+    COHERE_API_URL=http://localhost:5055 COHERE_API_KEY=fake python backend.py
+
+Distributions are written `fixed:<value>`, `uniform:<low>:<high>` or
+`lognormal:<median>:<sigma>`; latencies are in milliseconds, lengths in tokens.
+GET /stats reports the calls served so far.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "the a an of to and in is that it for as with on by this be are from at or we can which you "
+    "equation value function force energy example step first then result solve number variable "
+    "rate change motion mass speed graph term problem answer method rule because so if when"
+).split()
+
+
+class Distribution:
+    """Random samples from a `kind:arg:arg` spec"""
+
+    def __init__(self, spec):
+        kind, *args = str(spec).split(":")
+        args = [float(arg) for arg in args]
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2}
+        if kind not in expected or len(args) != expected[kind]:
+            raise ValueError(f"Bad distribution {spec!r}; use fixed:V, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA")
+        self.spec = spec
+        self.kind = kind
+        self.args = args
+
+    def sample(self, rng):
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.args)
+        median, sigma = self.args
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+@dataclass
+class FakeCohereConfig:
+    # Time to the full response, or to the first streamed chunk
+    latency: Distribution
+    # Time between streamed tokens
+    token_latency: Distribution
+    # Generated length, capped at the request's max_tokens
+    tokens: Distribution
+    classify_latency: Distribution
+    error_rate: float = 0.0
+    error_status: int = 500
+    seed: int = None
+
+    @classmethod
+    def from_env(cls, **overrides):
+        values = {
+            "latency": Distribution(os.getenv("FAKE_COHERE_LATENCY", "lognormal:300:0.4")),
+            "token_latency": Distribution(os.getenv("FAKE_COHERE_TOKEN_LATENCY", "fixed:5")),
+            "tokens": Distribution(os.getenv("FAKE_COHERE_TOKENS", "uniform:80:250")),
+            "classify_latency": Distribution(os.getenv("FAKE_COHERE_CLASSIFY_LATENCY", "lognormal:120:0.3")),
+            "error_rate": float(os.getenv("FAKE_COHERE_ERROR_RATE", "0")),
+            "error_status": int(os.getenv("FAKE_COHERE_ERROR_STATUS", "500")),
+            "seed": int(os.environ["FAKE_COHERE_SEED"]) if os.getenv("FAKE_COHERE_SEED") else None
+        }
+        values.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(**values)
+
+    def describe(self):
+        return {
+            "latency": self.latency.spec,
+            "token_latency": self.token_latency.spec,
+            "tokens": self.tokens.spec,
+            "classify_latency": self.classify_latency.spec,
+            "error_rate": self.error_rate,
+            "error_status": self.error_status,
+            "seed": self.seed
+        }
+
+
+class FakeCohereServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeCohereHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.rng_lock = threading.Lock()
+        self.calls = {"generate": 0, "generate_stream": 0, "classify": 0, "errors": 0}
+        self.calls_lock = threading.Lock()
+
+    def sample(self, distribution):
+        with self.rng_lock:
+            return distribution.sample(self.rng)
+
+    def should_fail(self):
+        with self.rng_lock:
+            return self.rng.random() < self.config.error_rate
+
+    def words(self, count):
+        with self.rng_lock:
+            return [self.rng.choice(WORDS) for _ in range(count)]
+
+    def count(self, name):
+        with self.calls_lock:
+            self.calls[name] += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class FakeCohereHandler(BaseHTTPRequestHandler):
+    server_version = "FakeCohere/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def pause(self, distribution):
+        time.sleep(max(0.0, self.server.sample(distribution)) / 1000)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            with self.server.calls_lock:
+                calls = dict(self.server.calls)
+            self.send_json({"calls": calls, "config": self.server.config.describe()})
+        else:
+            self.send_json({"message": f"Not found: {self.path}"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json({"message": "invalid json"}, 400)
+            return
+        if self.path == "/v1/generate":
+            self.generate(body)
+        elif self.path == "/v1/classify":
+            self.classify(body)
+        else:
+            self.send_json({"message": f"Not found: {self.path}"}, 404)
+
+    def fail(self):
+        self.server.count("errors")
+        self.send_json({"message": "injected failure"}, self.server.config.error_status)
+
+    def generate(self, body):
+        config = self.server.config
+        stream = bool(body.get("stream"))
+        self.server.count("generate_stream" if stream else "generate")
+        self.pause(config.latency)
+        if self.server.should_fail():
+            self.fail()
+            return
+
+        count = max(1, int(self.server.sample(config.tokens)))
+        if body.get("max_tokens"):
+            count = min(count, int(body["max_tokens"]))
+        words = self.server.words(count)
+        text = " " + " ".join(words).capitalize() + "."
+        generation = {"id": uuid.uuid4().hex, "text": text, "finish_reason": "COMPLETE"}
+        response = {"id": uuid.uuid4().hex, "generations": [generation], "prompt": body.get("prompt"),
+                    "meta": {"billed_units": {"input_tokens": len(str(body.get("prompt", "")).split()),
+                                              "output_tokens": count}}}
+        if not stream:
+            self.send_json(response)
+            return
+
+        # Newline-delimited JSON, one line per token; closing the connection ends the stream
+        self.send_response(200)
+        self.send_header("Content-Type", "application/stream+json")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for index, word in enumerate(words):
+                if index:
+                    self.pause(config.token_latency)
+                token = (" " + word.capitalize()) if index == 0 else (" " + word)
+                self.wfile.write(json.dumps({"text": token, "is_finished": False}).encode() + b"\n")
+                self.wfile.flush()
+            self.wfile.write(json.dumps({
+                "is_finished": True, "finish_reason": "COMPLETE", "response": response
+            }).encode() + b"\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+    def classify(self, body):
+        self.server.count("classify")
+        self.pause(self.server.config.classify_latency)
+        if self.server.should_fail():
+            self.fail()
+            return
+
+        # Label of the example sharing the most words with each input
+        examples = [(set(example["text"].lower().split()), example["label"]) for example in body.get("examples", [])]
+        labels = sorted({label for _, label in examples})
+        classifications = []
+        for text in body.get("inputs", []):
+            words = set(text.lower().split())
+            scores = {label: 0 for label in labels}
+            for example_words, label in examples:
+                scores[label] = max(scores[label], len(words & example_words))
+            prediction = max(labels, key=lambda label: scores[label]) if labels else None
+            classifications.append({
+                "id": uuid.uuid4().hex,
+                "input": text,
+                "prediction": prediction,
+                "predictions": [prediction],
+                "confidence": 0.9,
+                "confidences": [0.9],
+                "labels": {label: {"confidence": 0.9 if label == prediction else 0.1 / max(1, len(labels) - 1)}
+                           for label in labels}
+            })
+        self.send_json({"id": uuid.uuid4().hex, "classifications": classifications})
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """Serve on a background thread; returns the server (see .url and .shutdown())"""
+    server = FakeCohereServer((host, port), config or FakeCohereConfig.from_env())
+    threading.Thread(target=server.serve_forever, name="fake-cohere", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_COHERE_PORT", "5055")))
+    parser.add_argument("--latency", type=Distribution, help="generate latency in ms (FAKE_COHERE_LATENCY)")
+    parser.add_argument("--token-latency", type=Distribution, help="ms between streamed tokens")
+    parser.add_argument("--tokens", type=Distribution, help="generated length in tokens")
+    parser.add_argument("--classify-latency", type=Distribution, help="classify latency in ms")
+    parser.add_argument("--error-rate", type=float, help="share of calls that fail")
+    parser.add_argument("--error-status", type=int, help="HTTP status of failed calls (default 500)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    config = FakeCohereConfig.from_env(
+        latency=args.latency, token_latency=args.token_latency, tokens=args.tokens,
+        classify_latency=args.classify_latency, error_rate=args.error_rate,
+        error_status=args.error_status, seed=args.seed
+    )
+    server = FakeCohereServer((args.host, args.port), config)
+    print(f"Fake Cohere API on {server.url} with {json.dumps(config.describe())}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+
+# Production mode: gunicorn -c gunicorn.conf.py backend:app
+#
+# Every worker process loads its own copy of backend.py, so users, sessions
+# and progress must live in a store all of them share: TUTOR_STORE=sqlite with
+# one TUTOR_DB_PATH. Messages are written through (TUTOR_DB_FLUSH_MS=0) so a
+# history read served by any worker sees every message.
+
+bind = os.getenv("TUTOR_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("TUTOR_WORKERS", str(min(8, multiprocessing.cpu_count() * 2 + 1))))
+# Threaded workers keep streaming responses from tying up a whole process
+worker_class = "gthread"
+threads = int(os.getenv("TUTOR_WORKER_THREADS", "8"))
+# Long enough for a streamed generation
+timeout = int(os.getenv("TUTOR_WORKER_TIMEOUT", "120"))
+# Load the app after forking: store connections, thread pools and the
+# background batcher thread must not be shared with the parent
+preload_app = False
+
+raw_env = ["TUTOR_DB_FLUSH_MS=0"]
+
+
+def on_starting(server):
+    # server.cfg includes command-line overrides such as `-w 4`
+    if server.cfg.workers > 1 and os.getenv("TUTOR_STORE", "memory").lower() != "sqlite":
+        raise RuntimeError("Several workers need a shared store: set TUTOR_STORE=sqlite and TUTOR_DB_PATH")
@@ -0,0 +1,81 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class UpstreamHealth:
+    """Outcome of recent calls to the upstream model, per operation
+
+    Health checks read this instead of calling the model themselves, so
+    checking readiness never costs a generation.
+    """
+
+    def __init__(self):
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, ok, error=None):
+        now = datetime.now().isoformat()
+        with self._lock:
+            state = self._operations.setdefault(operation, {
+                'calls': 0,
+                'failures': 0,
+                'consecutive_failures': 0,
+                'last_success': None,
+                'last_failure': None,
+                'last_error': None
+            })
+            state['calls'] += 1
+            if ok:
+                state['consecutive_failures'] = 0
+                state['last_success'] = now
+            else:
+                state['failures'] += 1
+                state['consecutive_failures'] += 1
+                state['last_failure'] = now
+                state['last_error'] = str(error)
+
+    @contextmanager
+    def call(self, operation):
+        """Record the outcome of the upstream call made inside the block"""
+        try:
+            yield
+        except Exception as e:
+            self.record(operation, False, e)
+            raise
+        else:
+            self.record(operation, True)
+
+    def status(self):
+        with self._lock:
+            operations = {name: dict(state) for name, state in self._operations.items()}
+        if not operations:
+            status = 'unknown'
+        elif any(state['consecutive_failures'] for state in operations.values()):
+            status = 'degraded'
+        else:
+            status = 'ok'
+        return {'status': status, 'operations': operations}
+
+
+class HealthCache:
+    """Client-side cache of the last health check, shared by every clone"""
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._value = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, check):
+        # One caller refreshes an expired result; everyone else reuses it
+        with self._lock:
+            if self._value is None or time.time() >= self._expires_at:
+                self._value = check()
+                self._expires_at = time.time() + self.ttl
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
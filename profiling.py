@@ -0,0 +1,92 @@
+import itertools
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack every `interval` seconds
+
+    Runs on its own daemon thread, so the profiled code is not instrumented
+    and pays only for the GIL handoffs. Stacks are kept collapsed
+    (outermost;...;innermost), the input format of flame graph tools.
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.seconds = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.seconds = time.perf_counter() - self.started
+
+    def report(self, top=50):
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "duration_ms": round(self.seconds * 1000, 2),
+            "stacks": [{"stack": stack, "count": count} for stack, count in self.stacks.most_common(top)]
+        }
+
+
+class ProfileStore:
+    """The most recent `size` request profiles, by id"""
+
+    def __init__(self, size=20, interval=0.005):
+        self.size = size
+        self.interval = interval
+        self._profiles = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, name):
+        """Profile the calling thread for the duration of the block; yields the profile id"""
+        profile_id = f"{next(self._ids)}"
+        profiler = SamplingProfiler(threading.get_ident(), self.interval)
+        profiler.start()
+        try:
+            yield profile_id
+        finally:
+            profiler.stop()
+            with self._lock:
+                self._profiles[profile_id] = dict(profiler.report(), id=profile_id, name=name)
+                while len(self._profiles) > self.size:
+                    self._profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [
+                {"id": p["id"], "name": p["name"], "samples": p["samples"], "duration_ms": p["duration_ms"]}
+                for p in self._profiles.values()
+            ]
@@ -0,0 +1,102 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize(value):
+    """Case- and whitespace-insensitive form of a key component"""
+    return WHITESPACE_RE.sub(" ", str(value or "")).strip().lower()
+
+
+class ResponseCache:
+    """Bounded LRU cache with per-entry TTL and hit counters"""
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(subject, topic, education_level, question_type, message, context=""):
+        # The conversation context is long, so only its digest goes into the key
+        digest = hashlib.sha1(normalize(context).encode()).hexdigest()[:16] if context else ""
+        return tuple(normalize(part) for part in (subject, topic, education_level, question_type, message, digest))
+
+    def get(self, key):
+        """Return the cached value or None, counting the hit or miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["expires_at"] <= now:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            entry["hits"] += 1
+            self.hits += 1
+            return entry["value"]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "created_at": now,
+                "expires_at": now + self.ttl,
+                "hits": 0,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def flush(self):
+        """Drop every entry and return how many were removed"""
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def entries(self):
+        """Snapshot of live entries, most recently used first"""
+        now = time.time()
+        with self._lock:
+            items = list(self._entries.items())
+        return [
+            {
+                "key": dict(zip(("subject", "topic", "education_level", "question_type", "message", "context"), key)),
+                "hits": entry["hits"],
+                "age": round(now - entry["created_at"], 3),
+                "expires_in": round(entry["expires_at"] - now, 3),
+            }
+            for key, entry in reversed(items)
+            if entry["expires_at"] > now
+        ]
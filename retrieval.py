@@ -0,0 +1,175 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by can could do does for from give how i in is it its me my of on or "
+    "please show so some tell that the this to us what which why with you your about again more".split()
+)
+# Words that say what kind of answer is wanted rather than what it is about
+REQUEST_WORDS = frozenset(
+    "explain explanation example examples practice problem problems exercise exercises define definition "
+    "meaning mean means solve step steps help understand".split()
+)
+# Question type -> the kind of library snippet that can answer it on its own
+ANSWERING_KINDS = {"definition": "text", "example": "example", "practice": "practice"}
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(str(text).lower()) if token not in STOP_WORDS]
+
+
+@dataclass(frozen=True)
+class Snippet:
+    subject: str
+    topic: str
+    # "text" (a level's explanation), "example" or "practice"
+    kind: str
+    text: str
+    level: str = None
+
+
+def topic_snippets(subject, topic, entry):
+    """Split one content_library entry into indexable snippets"""
+    snippets = []
+    for key, value in entry.items():
+        if key in ("examples", "practice"):
+            kind = "example" if key == "examples" else "practice"
+            snippets.extend(Snippet(subject, topic, kind, str(item)) for item in value)
+        elif isinstance(value, str):
+            snippets.append(Snippet(subject, topic, "text", value, level=key))
+    return snippets
+
+
+class ContentIndex:
+    """BM25 index over content_library snippets
+
+    Built once at startup; update_topic() swaps one topic's snippets in place
+    when its content changes, without rebuilding the rest. Subject and topic
+    names are indexed with each snippet so questions naming a topic find it.
+    """
+
+    def __init__(self, library=None, k1=1.2, b=0.75, topic_boost=1.5):
+        self.k1 = k1
+        self.b = b
+        self.topic_boost = topic_boost
+        self._docs = {}
+        self._postings = defaultdict(dict)
+        self._topics = defaultdict(list)
+        self._total_length = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.updates = 0
+        for subject, topics in (library or {}).items():
+            for topic, entry in topics.items():
+                self.update_topic(subject, topic, entry)
+        self.updates = 0
+
+    def update_topic(self, subject, topic, entry):
+        """Replace the snippets of one subject/topic with those of `entry`"""
+        snippets = topic_snippets(subject, topic, entry)
+        with self._lock:
+            for doc_id in self._topics.pop((subject, topic), []):
+                _, terms, length = self._docs.pop(doc_id)
+                self._total_length -= length
+                for term in terms:
+                    postings = self._postings[term]
+                    del postings[doc_id]
+                    if not postings:
+                        del self._postings[term]
+            for snippet in snippets:
+                terms = Counter(tokenize(f"{snippet.text} {subject} {topic}"))
+                length = sum(terms.values())
+                doc_id = self._next_id
+                self._next_id += 1
+                self._docs[doc_id] = (snippet, terms, length)
+                self._total_length += length
+                self._topics[(subject, topic)].append(doc_id)
+                for term, count in terms.items():
+                    self._postings[term][doc_id] = count
+            self.updates += 1
+
+    def search(self, query, k=3, subject=None, topic=None):
+        """The k best (score, Snippet) pairs for `query`, best first
+
+        Snippets from the given subject/topic are boosted, not required.
+        """
+        start = time.perf_counter()
+        terms = set(tokenize(query)) - REQUEST_WORDS or set(tokenize(query))
+        scores = defaultdict(float)
+        with self._lock:
+            count = len(self._docs)
+            average = self._total_length / count if count else 0
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    length = self._docs[doc_id][2]
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average))
+            ranked = []
+            for doc_id, score in scores.items():
+                snippet = self._docs[doc_id][0]
+                if topic is not None and snippet.subject == subject and snippet.topic == topic:
+                    score *= self.topic_boost
+                ranked.append((score, doc_id, snippet))
+            ranked.sort(key=lambda item: (-item[0], item[1]))
+            self.searches += 1
+            self.search_seconds += time.perf_counter() - start
+        return [(round(score, 4), snippet) for score, _, snippet in ranked[:k]]
+
+    def topic_terms(self, subject, topic):
+        with self._lock:
+            terms = set(tokenize(f"{subject} {topic}"))
+            for doc_id in self._topics.get((subject, topic), []):
+                terms.update(self._docs[doc_id][1])
+            return terms
+
+    def direct_answer(self, message, subject, topic, question_type, level=None, follow_up=False):
+        """Text that answers the message from the library alone, or None
+
+        Only for definitions, examples and practice, when the message names
+        the topic and mentions nothing the topic's content does not cover. A
+        message naming nothing at all ("Can you give me an example?") is taken
+        to be about the topic unless it may be a `follow_up` to earlier turns.
+        """
+        kind = ANSWERING_KINDS.get(question_type)
+        if kind is None:
+            return None
+        words = set(tokenize(message)) - REQUEST_WORDS
+        topic_words = set(tokenize(topic))
+        if not topic_words:
+            return None
+        if words:
+            if not topic_words <= words or not words <= self.topic_terms(subject, topic):
+                return None
+        elif follow_up:
+            return None
+        with self._lock:
+            snippets = [self._docs[doc_id][0] for doc_id in self._topics.get((subject, topic), [])]
+        matching = [snippet for snippet in snippets if snippet.kind == kind]
+        if not matching:
+            return None
+        if kind == "text":
+            by_level = {snippet.level: snippet.text for snippet in matching}
+            return by_level.get((level or "").lower()) or by_level.get("beginner") or matching[0].text
+        heading = f"Here are some examples of {topic}:" if kind == "example" else f"Try these {topic} practice problems:"
+        return "\n".join([heading] + [f"- {snippet.text}" for snippet in matching])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "snippets": len(self._docs),
+                "terms": len(self._postings),
+                "topics": len(self._topics),
+                "updates": self.updates,
+                "searches": self.searches,
+                "mean_search_us": round(self.search_seconds / self.searches * 1e6, 1) if self.searches else 0.0
+            }
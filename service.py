@@ -0,0 +1,137 @@
+import json
+import time
+
+from flask import Response, jsonify, request, stream_with_context
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.http import parse_etags
+
+from metrics import HTTP_STAGE_SECONDS, REQUEST_SECONDS
+
+# Route handlers are written as plain service functions that take an ApiCall
+# and return a payload, an ApiResult or an EventStream. The same function
+# serves Flask requests, /api/batch items and the in-process client transport,
+# so only the HTTP path pays for JSON encoding.
+
+SERVICES = {}
+
+
+class ApiCall:
+    """Transport-independent view of one request"""
+
+    def __init__(self, method="GET", params=None, body=None, headers=None):
+        self.method = method
+        self.params = params or {}
+        self.body = body if body is not None else {}
+        self.headers = {k.lower(): v for k, v in (headers or {}).items()}
+
+    @classmethod
+    def from_flask(cls):
+        return cls(request.method, request.args.to_dict(), request.get_json(silent=True), dict(request.headers))
+
+    def header(self, name, default=""):
+        return self.headers.get(name.lower(), default)
+
+    def arg(self, name, default=None, type=None):
+        value = self.params.get(name)
+        if value is None:
+            return default
+        if type is None:
+            return value
+        try:
+            return type(value)
+        except (TypeError, ValueError):
+            return default
+
+    def if_none_match(self, etag):
+        return parse_etags(self.header("If-None-Match") or None).contains(etag)
+
+
+class ApiResult:
+    """A payload with an explicit status code and headers"""
+
+    def __init__(self, body=None, status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = headers or {}
+
+
+class EventStream:
+    """Server-sent events: an iterable of (payload, event_name) pairs"""
+
+    def __init__(self, events, headers=None):
+        self.events = events
+        self.headers = headers or {}
+
+
+def as_result(result):
+    if isinstance(result, (ApiResult, EventStream)):
+        return result
+    return ApiResult(result)
+
+
+def etag_header(tag):
+    return f'"{tag}"'
+
+
+def not_modified(etag, headers=None):
+    return ApiResult(None, 304, dict(headers or {}, ETag=etag_header(etag)))
+
+
+def sse_event(payload, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+
+def to_flask_response(result):
+    result = as_result(result)
+    if isinstance(result, EventStream):
+        return Response(
+            stream_with_context(sse_event(payload, event) for payload, event in result.events),
+            mimetype="text/event-stream",
+            headers=dict({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, **result.headers)
+        )
+    if result.status == 304:
+        return Response(status=304, headers=result.headers)
+    response = jsonify(result.body)
+    response.status_code = result.status
+    response.headers.update(result.headers)
+    return response
+
+
+def api_route(app, rule, methods):
+    """Register a service function as a Flask route and as a directly callable service"""
+    def decorator(fn):
+        def view(**view_args):
+            start = time.perf_counter()
+            call = ApiCall.from_flask()
+            parsed = time.perf_counter()
+            result = fn(call, **view_args)
+            handled = time.perf_counter()
+            response = to_flask_response(result)
+            done = time.perf_counter()
+            HTTP_STAGE_SECONDS.observe(parsed - start, route=fn.__name__, stage="parse")
+            HTTP_STAGE_SECONDS.observe(done - handled, route=fn.__name__, stage="serialize")
+            # Streams are timed to their headers; the events follow later
+            REQUEST_SECONDS.observe(done - start, route=fn.__name__, status=response.status_code)
+            return response
+
+        view.__name__ = fn.__name__
+        app.add_url_rule(rule, endpoint=fn.__name__, view_func=view, methods=methods)
+        SERVICES[fn.__name__] = fn
+        return fn
+    return decorator
+
+
+def dispatch(app, method, path, params=None, body=None, headers=None):
+    """Call the service behind `path` directly, without HTTP or JSON"""
+    adapter = app.url_map.bind("localhost")
+    try:
+        endpoint, view_args = adapter.match(path, method=method)
+    except NotFound:
+        return ApiResult({"error": f"Not found: {path}"}, 404)
+    except MethodNotAllowed:
+        return ApiResult({"error": f"Method not allowed: {method} {path}"}, 405)
+    service = SERVICES.get(endpoint)
+    if service is None:
+        return ApiResult({"error": f"Not available without HTTP: {path}"}, 400)
+    return as_result(service(ApiCall(method, params, body, headers), **view_args))
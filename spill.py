@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+META_FILE = "meta.json"
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+
+class SegmentSpill:
+    """On-disk overflow for chat sessions
+
+    Each session gets a directory of numbered, gzip-compressed JSON-lines
+    segments holding its oldest messages in order, plus a meta.json with the
+    session header when the whole session has been evicted from memory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.segments_written = 0
+        self.messages_written = 0
+        self.reloads = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _session_dir(self, session_id):
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def _segments(self, session_id):
+        path = self._session_dir(session_id)
+        if not os.path.isdir(path):
+            return []
+        names = sorted(n for n in os.listdir(path) if n.startswith(SEGMENT_PREFIX))
+        return [os.path.join(path, n) for n in names]
+
+    def write_segment(self, session_id, messages):
+        """Append messages to the session's on-disk history as a new segment"""
+        if not messages:
+            return
+        path = self._session_dir(session_id)
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            index = len(self._segments(session_id)) + 1
+            segment = os.path.join(path, f"{SEGMENT_PREFIX}{index:06d}{SEGMENT_SUFFIX}")
+            with gzip.open(segment, "wt", encoding="utf-8") as f:
+                for message in messages:
+                    f.write(json.dumps(message, separators=(",", ":")))
+                    f.write("\n")
+            self.segments_written += 1
+            self.messages_written += len(messages)
+
+    def read_messages(self, session_id, limit=None):
+        """The session's spilled messages, oldest first
+
+        With `limit`, only the first `limit` of them: segments are complete
+        once counted, so a reader never opens one that is still being written.
+        """
+        messages = []
+        for segment in self._segments(session_id):
+            if limit is not None and len(messages) >= limit:
+                break
+            with gzip.open(segment, "rt", encoding="utf-8") as f:
+                messages.extend(json.loads(line) for line in f if line.strip())
+        if limit is not None:
+            messages = messages[:limit]
+        if messages:
+            self.reloads += 1
+        return messages
+
+    def write_meta(self, session_id, meta):
+        path = self._session_dir(session_id)
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, separators=(",", ":"))
+
+    def read_meta(self, session_id):
+        path = os.path.join(self._session_dir(session_id), META_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def clear_meta(self, session_id):
+        path = os.path.join(self._session_dir(session_id), META_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def drop(self, session_id):
+        shutil.rmtree(self._session_dir(session_id), ignore_errors=True)
+
+    def stats(self):
+        disk_bytes = 0
+        for root, _, files in os.walk(self.directory):
+            disk_bytes += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return {
+            "directory": self.directory,
+            "segments_written": self.segments_written,
+            "messages_written": self.messages_written,
+            "reloads": self.reloads,
+            "disk_bytes": disk_bytes,
+        }
@@ -0,0 +1,839 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from spill import SegmentSpill
+
+logger = logging.getLogger(__name__)
+
+
+def empty_aggregates():
+    return {'interactions': 0, 'topics_touched': 0, 'last_interaction': None, 'subjects': {}}
+
+
+def summarize_progress(progress):
+    """Recompute a user's progress aggregates from scratch"""
+    aggregates = empty_aggregates()
+    for subject, topics in progress.items():
+        totals = {'interactions': 0, 'topics': len(topics), 'last_interaction': None}
+        for stats in topics.values():
+            totals['interactions'] += stats['interactions']
+            totals['last_interaction'] = max_timestamp(totals['last_interaction'], stats['last_interaction'])
+        aggregates['subjects'][subject] = totals
+        aggregates['interactions'] += totals['interactions']
+        aggregates['topics_touched'] += totals['topics']
+        aggregates['last_interaction'] = max_timestamp(aggregates['last_interaction'], totals['last_interaction'])
+    return aggregates
+
+
+def max_timestamp(a, b):
+    # ISO timestamps compare correctly as strings
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class Store:
+    """Storage for users, chat sessions and learning progress
+
+    Users are returned in the shape the API has always used:
+    {'name', 'education_level', 'created_at', 'progress', 'session_count'}
+    with progress as {subject: {topic: {'interactions', 'last_interaction'}}}.
+    Sessions are {'user_id', 'subject', 'topic', 'messages', 'start_time'}.
+    Every stored message carries a 'seq' number that increases within its
+    session and serves as the history cursor.
+    """
+
+    def create_user(self, user_id, name, education_level):
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def user_exists(self, user_id):
+        return self.get_user(user_id) is not None
+
+    def count_users(self):
+        raise NotImplementedError
+
+    def ensure_session(self, session_id, user_id, subject, topic):
+        """Create the session if it does not exist yet"""
+        raise NotImplementedError
+
+    def get_session(self, session_id, since=0, limit=None, before=None):
+        """Return the session with its messages after seq `since`, at most `limit` of them
+
+        With `before`, only messages older than that seq are returned and `limit`
+        keeps the newest of them, for paging backwards through history.
+        """
+        raise NotImplementedError
+
+    def last_seq(self, session_id):
+        """Seq of the newest message (0 if empty), or None if the session does not exist"""
+        raise NotImplementedError
+
+    def count_sessions(self):
+        raise NotImplementedError
+
+    def append_message(self, session_id, message):
+        """Store a message at the end of the session and return its seq"""
+        raise NotImplementedError
+
+    def get_progress(self, user_id):
+        """Return the user's progress dict, or None if the user does not exist"""
+        user = self.get_user(user_id)
+        return user['progress'] if user is not None else None
+
+    def record_interaction(self, user_id, subject, topic):
+        """Count one interaction for an existing user; unknown users are ignored
+
+        The user's running aggregates are updated in the same step.
+        """
+        raise NotImplementedError
+
+    def get_aggregates(self, user_id):
+        """Running totals {'interactions', 'topics_touched', 'last_interaction', 'subjects'},
+        or None if the user does not exist"""
+        raise NotImplementedError
+
+    def set_aggregates(self, user_id, aggregates):
+        raise NotImplementedError
+
+    def user_ids(self):
+        raise NotImplementedError
+
+    def cohort_rows(self, education_level=None):
+        """Bulk export for analytics: ([(user_id, education_level)],
+        [(user_id, subject, topic, interactions, last_interaction)])"""
+        raise NotImplementedError
+
+    def verify_aggregates(self, rebuild=False):
+        """Compare running aggregates with a full recompute; optionally repair mismatches
+
+        Returns the ids of users whose aggregates did not match.
+        """
+        mismatched = []
+        for user_id in self.user_ids():
+            expected = summarize_progress(self.get_progress(user_id) or {})
+            if self.get_aggregates(user_id) != expected:
+                mismatched.append(user_id)
+                if rebuild:
+                    self.set_aggregates(user_id, expected)
+        return mismatched
+
+    def load_dicts(self, users, sessions):
+        """Import data in the shape of the old module-level `users`/`sessions` dicts"""
+        raise NotImplementedError
+
+    def memory_stats(self):
+        """Gauges for sizing instances"""
+        return {}
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class MemoryStore(Store):
+    """Process-local store backed by plain dicts
+
+    Each session keeps at most `max_messages` recent messages in memory. Older
+    messages, and whole sessions idle for longer than `idle_ttl` seconds, spill
+    to on-disk segments and are reloaded transparently on access.
+
+    Progress updates take a per-user lock (striped over USER_LOCK_STRIPES), so
+    concurrent requests for different users don't serialize on the store lock.
+    The store is process-local; multi-process deployments need SQLiteStore.
+    """
+
+    USER_LOCK_STRIPES = 64
+
+    def __init__(self, max_messages=None, idle_ttl=None, spill=None, sweep_interval=60):
+        self.users = {}
+        self.aggregates = {}
+        self.sessions = {}
+        self.evicted = set()
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.spill = spill
+        self.sweep_interval = sweep_interval
+        self.evictions = 0
+        self.overflows = 0
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+        self._user_locks = [threading.Lock() for _ in range(self.USER_LOCK_STRIPES)]
+
+    def _user_lock(self, user_id):
+        return self._user_locks[hash(user_id) % len(self._user_locks)]
+
+    def create_user(self, user_id, name, education_level):
+        with self._lock, self._user_lock(user_id):
+            self.users[user_id] = {
+                'name': name,
+                'education_level': education_level,
+                'created_at': datetime.now().isoformat(),
+                'progress': {},
+                'session_count': 0
+            }
+            self.aggregates[user_id] = empty_aggregates()
+
+    def get_user(self, user_id):
+        # A snapshot, so callers in this process never share the live progress dicts
+        with self._user_lock(user_id):
+            user = self.users.get(user_id)
+            if user is None:
+                return None
+            progress = {s: {t: dict(p) for t, p in topics.items()} for s, topics in user['progress'].items()}
+            return dict(user, progress=progress)
+
+    def user_exists(self, user_id):
+        return user_id in self.users
+
+    def user_ids(self):
+        return list(self.users)
+
+    def cohort_rows(self, education_level=None):
+        with self._lock:
+            users = [
+                (user_id, user['education_level'])
+                for user_id, user in self.users.items()
+                if education_level is None or user['education_level'] == education_level
+            ]
+            rows = []
+            for user_id, _ in users:
+                with self._user_lock(user_id):
+                    rows.extend(
+                        (user_id, subject, topic, stats['interactions'], stats['last_interaction'])
+                        for subject, topics in self.users[user_id]['progress'].items()
+                        for topic, stats in topics.items()
+                    )
+        return users, rows
+
+    def count_users(self):
+        return len(self.users)
+
+    def ensure_session(self, session_id, user_id, subject, topic):
+        with self._lock:
+            self._maybe_sweep()
+            if self._resident(session_id) is None:
+                if self.spill is not None:
+                    # Clear anything left over from an earlier session with this id
+                    self.spill.drop(session_id)
+                self.sessions[session_id] = self._record(user_id, subject, topic, datetime.now().isoformat())
+
+    def get_session(self, session_id, since=0, limit=None, before=None):
+        with self._lock:
+            record = self._resident(session_id)
+            if record is None:
+                return None
+            messages = list(record['messages'])
+            spilled = record['spilled']
+        if before is not None:
+            messages = [m for m in messages if m['seq'] < before]
+        # Only go to disk when the cursor reaches back into spilled history
+        reaches_disk = before is None or limit is None or len(messages) < limit
+        if spilled and since < spilled and reaches_disk:
+            # Outside the lock, so only the messages counted in the snapshot: a
+            # concurrent spill adds segments after them, which would repeat seqs
+            older = self.spill.read_messages(session_id, limit=spilled)
+            if before is not None:
+                older = [m for m in older if m['seq'] < before]
+            messages = older + messages
+        if since:
+            messages = [m for m in messages if m['seq'] > since]
+        if limit is not None:
+            messages = messages[-limit:] if before is not None else messages[:limit]
+        return {
+            'user_id': record['user_id'],
+            'subject': record['subject'],
+            'topic': record['topic'],
+            'messages': messages,
+            'start_time': record['start_time']
+        }
+
+    def last_seq(self, session_id):
+        with self._lock:
+            record = self._resident(session_id)
+            return record['last_seq'] if record is not None else None
+
+    def count_sessions(self):
+        return len(self.sessions) + len(self.evicted)
+
+    def append_message(self, session_id, message):
+        with self._lock:
+            record = self._resident(session_id)
+            record['last_seq'] += 1
+            seq = record['last_seq']
+            record['messages'].append(dict(message, seq=seq))
+            if self.max_messages and len(record['messages']) > self.max_messages:
+                # Spill the oldest half of the buffer as one segment
+                overflow = len(record['messages']) - self.max_messages // 2
+                chunk = [record['messages'].popleft() for _ in range(overflow)]
+                self.overflows += 1
+                if self.spill is not None:
+                    self.spill.write_segment(session_id, chunk)
+                    record['spilled'] += len(chunk)
+            return seq
+
+    def record_interaction(self, user_id, subject, topic):
+        with self._user_lock(user_id):
+            if user_id not in self.users:
+                return
+            now = datetime.now().isoformat()
+            progress = self.users[user_id]['progress']
+            aggregates = self.aggregates[user_id]
+            if subject not in progress:
+                progress[subject] = {}
+                aggregates['subjects'][subject] = {'interactions': 0, 'topics': 0, 'last_interaction': None}
+            totals = aggregates['subjects'][subject]
+            if topic not in progress[subject]:
+                progress[subject][topic] = {
+                    'interactions': 0,
+                    'last_interaction': None
+                }
+                totals['topics'] += 1
+                aggregates['topics_touched'] += 1
+            progress[subject][topic]['interactions'] += 1
+            progress[subject][topic]['last_interaction'] = now
+            totals['interactions'] += 1
+            totals['last_interaction'] = now
+            aggregates['interactions'] += 1
+            aggregates['last_interaction'] = now
+
+    def get_aggregates(self, user_id):
+        with self._user_lock(user_id):
+            aggregates = self.aggregates.get(user_id)
+            if aggregates is None:
+                return None
+            return dict(aggregates, subjects={k: dict(v) for k, v in aggregates['subjects'].items()})
+
+    def set_aggregates(self, user_id, aggregates):
+        with self._user_lock(user_id):
+            self.aggregates[user_id] = aggregates
+
+    def load_dicts(self, users, sessions):
+        with self._lock:
+            for user_id, user in users.items():
+                with self._user_lock(user_id):
+                    self.users[user_id] = user
+                    self.aggregates[user_id] = summarize_progress(user.get('progress', {}))
+            for session_id, session in sessions.items():
+                record = self._record(
+                    session.get('user_id', 'anonymous'), session.get('subject'), session.get('topic'),
+                    session.get('start_time', datetime.now().isoformat())
+                )
+                if self.spill is not None:
+                    self.spill.drop(session_id)
+                self.sessions[session_id] = record
+                for message in session.get('messages', []):
+                    self.append_message(session_id, message)
+
+    def evict_idle(self, now=None):
+        """Move sessions idle for longer than idle_ttl out of memory"""
+        if not self.idle_ttl:
+            return 0
+        now = now or time.time()
+        with self._lock:
+            idle = [sid for sid, record in self.sessions.items() if now - record['last_access'] > self.idle_ttl]
+            for session_id in idle:
+                record = self.sessions.pop(session_id)
+                self.evictions += 1
+                if self.spill is None:
+                    continue
+                self.spill.write_segment(session_id, list(record['messages']))
+                self.spill.write_meta(session_id, {
+                    'user_id': record['user_id'],
+                    'subject': record['subject'],
+                    'topic': record['topic'],
+                    'start_time': record['start_time'],
+                    'spilled': record['spilled'] + len(record['messages']),
+                    'last_seq': record['last_seq']
+                })
+                self.evicted.add(session_id)
+            self._last_sweep = now
+            return len(idle)
+
+    def memory_stats(self):
+        with self._lock:
+            records = list(self.sessions.values())
+            resident_messages = sum(len(r['messages']) for r in records)
+            content_bytes = sum(len(m.get('content', '').encode('utf-8')) for r in records for m in r['messages'])
+            stats = {
+                'users': len(self.users),
+                'resident_sessions': len(records),
+                'evicted_sessions': len(self.evicted),
+                'resident_messages': resident_messages,
+                'spilled_messages': sum(r['spilled'] for r in records),
+                'resident_content_bytes': content_bytes,
+                'max_messages': self.max_messages,
+                'idle_ttl': self.idle_ttl,
+                'evictions': self.evictions,
+                'overflows': self.overflows
+            }
+        if self.spill is not None:
+            stats['spill'] = self.spill.stats()
+        return stats
+
+    def _record(self, user_id, subject, topic, start_time):
+        return {
+            'user_id': user_id,
+            'subject': subject,
+            'topic': topic,
+            'messages': deque(),
+            'start_time': start_time,
+            'spilled': 0,
+            'last_seq': 0,
+            'last_access': time.time()
+        }
+
+    def _resident(self, session_id):
+        # Return the in-memory record, reloading an evicted session if needed
+        record = self.sessions.get(session_id)
+        if record is None and session_id in self.evicted:
+            meta = self.spill.read_meta(session_id)
+            self.spill.clear_meta(session_id)
+            self.evicted.discard(session_id)
+            record = self.sessions[session_id] = self._record(
+                meta['user_id'], meta['subject'], meta['topic'], meta['start_time']
+            )
+            record['spilled'] = meta['spilled']
+            record['last_seq'] = meta['last_seq']
+        if record is not None:
+            record['last_access'] = time.time()
+        return record
+
+    def _maybe_sweep(self):
+        if self.idle_ttl and time.time() - self._last_sweep > self.sweep_interval:
+            self.evict_idle()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    education_level TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    session_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    subject TEXT,
+    topic TEXT,
+    start_time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_id ON sessions (user_id);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session_id ON messages (session_id, id);
+CREATE TABLE IF NOT EXISTS progress (
+    user_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    interactions INTEGER NOT NULL DEFAULT 0,
+    last_interaction TEXT,
+    PRIMARY KEY (user_id, subject, topic)
+);
+CREATE INDEX IF NOT EXISTS idx_progress_user_id ON progress (user_id);
+CREATE TABLE IF NOT EXISTS subject_totals (
+    user_id TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    interactions INTEGER NOT NULL DEFAULT 0,
+    topics INTEGER NOT NULL DEFAULT 0,
+    last_interaction TEXT,
+    PRIMARY KEY (user_id, subject)
+);
+CREATE TABLE IF NOT EXISTS user_totals (
+    user_id TEXT PRIMARY KEY,
+    interactions INTEGER NOT NULL DEFAULT 0,
+    topics_touched INTEGER NOT NULL DEFAULT 0,
+    last_interaction TEXT
+);
+"""
+
+# Message ids double as seq numbers: they only increase, so they work as a cursor
+MESSAGE_COLUMNS = ('seq', 'role', 'content', 'timestamp')
+# A NULL id lets SQLite pick the next one
+MESSAGE_INSERT = "INSERT INTO messages (id, session_id, role, content, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+class SQLiteStore(Store):
+    """SQLite store in WAL mode with write-behind inserts for chat messages
+
+    Messages are queued and written by a background thread in batched
+    transactions, so the request path never waits on fsync. Reads of a
+    session flush the queue first, so they always see every appended message.
+    Queued messages get their ids from this process, in queue order, so
+    append_message can return the seq before the row is written.
+    A `flush_interval` of 0 writes messages through instead, which is what
+    several processes sharing one database need: each process can only flush
+    its own queue.
+
+    Counters are only ever changed with `x = x + 1` inside a write
+    transaction, so concurrent threads and processes never lose increments.
+    """
+
+    def __init__(self, path, flush_interval=0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._pending = queue.Queue()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        self._last_id = conn.execute(
+            "SELECT MAX((SELECT COALESCE(MAX(id), 0) FROM messages), "
+            "(SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'messages'))"
+        ).fetchone()[0]
+        self._id_lock = threading.Lock()
+        conn.close()
+
+        self._writer = None
+        if flush_interval > 0:
+            self._writer = threading.Thread(target=self._write_behind, name="sqlite-writer", daemon=True)
+            self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @property
+    def conn(self):
+        # One connection per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def create_user(self, user_id, name, education_level):
+        with self.conn as conn:
+            for table in ('progress', 'subject_totals', 'user_totals'):
+                conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user_id, name, education_level, created_at, session_count) "
+                "VALUES (?, ?, ?, ?, 0)",
+                (user_id, name, education_level, datetime.now().isoformat())
+            )
+            conn.execute("INSERT INTO user_totals (user_id) VALUES (?)", (user_id,))
+
+    def user_ids(self):
+        return [row[0] for row in self.conn.execute("SELECT user_id FROM users")]
+
+    def cohort_rows(self, education_level=None):
+        where, params = ("WHERE u.education_level = ?", (education_level,)) if education_level else ("", ())
+        users = [tuple(row) for row in self.conn.execute(
+            f"SELECT u.user_id, u.education_level FROM users u {where}", params
+        )]
+        rows = [tuple(row) for row in self.conn.execute(
+            "SELECT p.user_id, p.subject, p.topic, p.interactions, p.last_interaction "
+            f"FROM progress p JOIN users u ON u.user_id = p.user_id {where}", params
+        )]
+        return users, rows
+
+    def get_user(self, user_id):
+        row = self.conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            'name': row['name'],
+            'education_level': row['education_level'],
+            'created_at': row['created_at'],
+            'progress': self._progress(user_id),
+            'session_count': row['session_count']
+        }
+
+    def user_exists(self, user_id):
+        return self.conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is not None
+
+    def count_users(self):
+        return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def ensure_session(self, session_id, user_id, subject, topic):
+        with self.conn as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO sessions (session_id, user_id, subject, topic, start_time) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (session_id, user_id, subject, topic, datetime.now().isoformat())
+            )
+
+    def get_session(self, session_id, since=0, limit=None, before=None):
+        row = self.conn.execute("SELECT * FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        self.flush()
+        if before is None:
+            messages = self.conn.execute(
+                "SELECT id, role, content, timestamp, extra FROM messages WHERE session_id = ? AND id > ? "
+                "ORDER BY id LIMIT ?",
+                (session_id, since or 0, -1 if limit is None else limit)
+            ).fetchall()
+        else:
+            # Newest first to apply the limit, then back into order
+            messages = self.conn.execute(
+                "SELECT id, role, content, timestamp, extra FROM messages WHERE session_id = ? AND id > ? "
+                "AND id < ? ORDER BY id DESC LIMIT ?",
+                (session_id, since or 0, before, -1 if limit is None else limit)
+            ).fetchall()[::-1]
+        return {
+            'user_id': row['user_id'],
+            'subject': row['subject'],
+            'topic': row['topic'],
+            'messages': [self._message(m) for m in messages],
+            'start_time': row['start_time']
+        }
+
+    def count_sessions(self):
+        return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def last_seq(self, session_id):
+        if self.conn.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is None:
+            return None
+        self.flush()
+        return self.conn.execute(
+            "SELECT COALESCE(MAX(id), 0) FROM messages WHERE session_id = ?", (session_id,)
+        ).fetchone()[0]
+
+    def append_message(self, session_id, message):
+        if self._writer is None:
+            with self.conn as conn:
+                return conn.execute(MESSAGE_INSERT, self._message_row(None, session_id, message)).lastrowid
+        return self._enqueue(session_id, message)
+
+    def _enqueue(self, session_id, message):
+        # Ids are taken and queued under one lock, so a flush never writes an
+        # id while a smaller one is still on its way to the queue
+        with self._id_lock:
+            self._last_id += 1
+            self._pending.put(self._message_row(self._last_id, session_id, message))
+            return self._last_id
+
+    def memory_stats(self):
+        return {
+            'users': self.count_users(),
+            'sessions': self.count_sessions(),
+            'pending_writes': self._pending.qsize()
+        }
+
+    def get_progress(self, user_id):
+        if not self.user_exists(user_id):
+            return None
+        return self._progress(user_id)
+
+    def record_interaction(self, user_id, subject, topic):
+        now = datetime.now().isoformat()
+        with self.conn as conn:
+            created = conn.execute(
+                "INSERT OR IGNORE INTO progress (user_id, subject, topic, interactions, last_interaction) "
+                "SELECT ?, ?, ?, 0, NULL WHERE EXISTS (SELECT 1 FROM users WHERE user_id = ?)",
+                (user_id, subject, topic, user_id)
+            ).rowcount
+            updated = conn.execute(
+                "UPDATE progress SET interactions = interactions + 1, last_interaction = ? "
+                "WHERE user_id = ? AND subject = ? AND topic = ?",
+                (now, user_id, subject, topic)
+            ).rowcount
+            if not updated:
+                return
+            new_topic = 1 if created else 0
+            conn.execute(
+                "INSERT INTO subject_totals (user_id, subject, interactions, topics, last_interaction) "
+                "VALUES (?, ?, 1, ?, ?) ON CONFLICT (user_id, subject) DO UPDATE SET "
+                "interactions = interactions + 1, topics = topics + excluded.topics, "
+                "last_interaction = excluded.last_interaction",
+                (user_id, subject, new_topic, now)
+            )
+            conn.execute(
+                "INSERT INTO user_totals (user_id, interactions, topics_touched, last_interaction) "
+                "VALUES (?, 1, ?, ?) ON CONFLICT (user_id) DO UPDATE SET "
+                "interactions = interactions + 1, topics_touched = topics_touched + excluded.topics_touched, "
+                "last_interaction = excluded.last_interaction",
+                (user_id, new_topic, now)
+            )
+
+    def get_aggregates(self, user_id):
+        row = self.conn.execute("SELECT * FROM user_totals WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        subjects = {
+            r['subject']: {
+                'interactions': r['interactions'],
+                'topics': r['topics'],
+                'last_interaction': r['last_interaction']
+            }
+            for r in self.conn.execute(
+                "SELECT subject, interactions, topics, last_interaction FROM subject_totals WHERE user_id = ?",
+                (user_id,)
+            )
+        }
+        return {
+            'interactions': row['interactions'],
+            'topics_touched': row['topics_touched'],
+            'last_interaction': row['last_interaction'],
+            'subjects': subjects
+        }
+
+    def set_aggregates(self, user_id, aggregates):
+        with self.conn as conn:
+            self._write_aggregates(conn, user_id, aggregates)
+
+    @staticmethod
+    def _write_aggregates(conn, user_id, aggregates):
+        conn.execute("DELETE FROM subject_totals WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO subject_totals (user_id, subject, interactions, topics, last_interaction) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(user_id, subject, t['interactions'], t['topics'], t['last_interaction'])
+             for subject, t in aggregates['subjects'].items()]
+        )
+        conn.execute(
+            "INSERT OR REPLACE INTO user_totals (user_id, interactions, topics_touched, last_interaction) "
+            "VALUES (?, ?, ?, ?)",
+            (user_id, aggregates['interactions'], aggregates['topics_touched'], aggregates['last_interaction'])
+        )
+
+    def load_dicts(self, users, sessions):
+        with self.conn as conn:
+            for user_id, user in users.items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO users (user_id, name, education_level, created_at, session_count) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (user_id, user.get('name', 'Student'), user.get('education_level', 'Beginner'),
+                     user.get('created_at', datetime.now().isoformat()), user.get('session_count', 0))
+                )
+                conn.execute("DELETE FROM progress WHERE user_id = ?", (user_id,))
+                for subject, topics in user.get('progress', {}).items():
+                    for topic, stats in topics.items():
+                        conn.execute(
+                            "INSERT OR REPLACE INTO progress (user_id, subject, topic, interactions, last_interaction) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (user_id, subject, topic, stats.get('interactions', 0), stats.get('last_interaction'))
+                        )
+                self._write_aggregates(conn, user_id, summarize_progress(user.get('progress', {})))
+            for session_id, session in sessions.items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, user_id, subject, topic, start_time) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (session_id, session.get('user_id', 'anonymous'), session.get('subject'), session.get('topic'),
+                     session.get('start_time', datetime.now().isoformat()))
+                )
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                messages = session.get('messages', [])
+                if self._writer is not None:
+                    # Queued ids come from this process; imported rows must not take them
+                    for message in messages:
+                        self._enqueue(session_id, message)
+                else:
+                    conn.executemany(MESSAGE_INSERT, [self._message_row(None, session_id, m) for m in messages])
+
+    def flush(self):
+        """Write every queued message now
+
+        A failed write rolls back as a whole and its rows go back on the
+        queue, so the next flush retries them; the error is re-raised.
+        """
+        with self._flush_lock:
+            rows = []
+            while True:
+                try:
+                    rows.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            if rows:
+                try:
+                    with self.conn as conn:
+                        conn.executemany(MESSAGE_INSERT, rows)
+                except sqlite3.Error:
+                    # Rows carry their ids, so requeueing them out of order is harmless
+                    for row in rows:
+                        self._pending.put(row)
+                    raise
+
+    def close(self):
+        self._closed.set()
+        if self._writer is not None:
+            self._writer.join(timeout=5)
+        self.flush()
+
+    def _write_behind(self):
+        while not self._closed.is_set():
+            self._closed.wait(self.flush_interval)
+            try:
+                self.flush()
+            except sqlite3.Error:
+                logger.exception("SQLite write-behind failed, %d messages queued for retry", self._pending.qsize())
+
+    def _progress(self, user_id):
+        progress = {}
+        for row in self.conn.execute(
+            "SELECT subject, topic, interactions, last_interaction FROM progress WHERE user_id = ?", (user_id,)
+        ):
+            progress.setdefault(row['subject'], {})[row['topic']] = {
+                'interactions': row['interactions'],
+                'last_interaction': row['last_interaction']
+            }
+        return progress
+
+    @staticmethod
+    def _message_row(message_id, session_id, message):
+        extra = {k: v for k, v in message.items() if k not in MESSAGE_COLUMNS}
+        return (message_id, session_id, message['role'], message['content'], message['timestamp'],
+                json.dumps(extra) if extra else None)
+
+    @staticmethod
+    def _message(row):
+        message = {'role': row['role'], 'content': row['content'], 'timestamp': row['timestamp'], 'seq': row['id']}
+        if row['extra']:
+            message.update(json.loads(row['extra']))
+        return message
+
+
+def create_store():
+    """Build the store selected by TUTOR_STORE ('memory' or 'sqlite')"""
+    kind = os.getenv("TUTOR_STORE", "memory").lower()
+    if kind == "sqlite":
+        return SQLiteStore(
+            os.getenv("TUTOR_DB_PATH", "tutor.db"),
+            flush_interval=float(os.getenv("TUTOR_DB_FLUSH_MS", "50")) / 1000
+        )
+    if kind == "memory":
+        return MemoryStore(
+            max_messages=int(os.getenv("TUTOR_SESSION_MAX_MESSAGES", "200")),
+            idle_ttl=float(os.getenv("TUTOR_SESSION_IDLE_TTL", "1800")),
+            spill=SegmentSpill(os.getenv("TUTOR_SPILL_DIR", ".tutor_spill"))
+        )
+    raise ValueError(f"Unknown TUTOR_STORE: {kind}")
+
+
+if __name__ == '__main__':
+    # Migrate a JSON dump of the old in-memory dicts ({"users": ..., "sessions": ...})
+    # into a SQLite database: python storage.py dump.json tutor.db
+    if len(sys.argv) != 3:
+        sys.exit("usage: python storage.py <dump.json> <database>")
+    with open(sys.argv[1], encoding="utf-8") as f:
+        dump = json.load(f)
+    store = SQLiteStore(sys.argv[2])
+    store.load_dicts(dump.get('users', {}), dump.get('sessions', {}))
+    store.close()
+    print(f"Imported {len(dump.get('users', {}))} users and {len(dump.get('sessions', {}))} sessions")
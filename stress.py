@@ -0,0 +1,143 @@
+"""Concurrency stress test for the chat path
+
+Hammers /api/chat/message from many processes and threads, then checks that
+no interaction or message was lost and that generated ids never collided:
+
+    gunicorn -c gunicorn.conf.py backend:app          # TUTOR_STORE=sqlite, rate limits off
+    python stress.py --processes 4 --threads 8 --messages 25
+
+Requests go through TutorAPIClient, so TUTOR_API_URL picks the server. With
+TUTOR_TRANSPORT=inprocess and TUTOR_STORE=sqlite every process runs its own
+backend against the shared database instead, writing messages through. Set RATE_LIMIT_USER_PER_MIN=0 and
+RATE_LIMIT_GLOBAL_PER_SEC=0 for the server, or admission control answers most
+of the traffic with 429. Exits non-zero on any mismatch.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# In process, every worker runs its own store on the shared database and the
+# pool stops workers without flushing a write-behind queue, so write through.
+# Set before api_client builds the in-process backend, here and in each worker
+if os.getenv("TUTOR_TRANSPORT", "http").lower() == "inprocess":
+    os.environ["TUTOR_DB_FLUSH_MS"] = "0"
+
+import api_models as models
+from api_client import api_client
+
+SUBJECTS = [("Mathematics", "Algebra"), ("Mathematics", "Calculus"), ("Physics", "Mechanics")]
+
+
+def run_thread(worker, user_ids, messages, fresh):
+    client = api_client.clone()
+    client.session_id = f"stress_{worker}_{models.new_session_id()}"
+    rng = random.Random(worker)
+    counts = Counter()
+    failures = 0
+    for i in range(messages):
+        client.user_id = rng.choice(user_ids)
+        subject, topic = rng.choice(SUBJECTS)
+        response = client.send_message(f"Explain {topic} please ({i % 3})", subject, topic, fresh=fresh)
+        if "error" in response:
+            failures += 1
+        else:
+            counts[(client.user_id, subject)] += 1
+    return client.session_id, counts, failures
+
+
+def run_process(process_index, threads, user_ids, messages, fresh):
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(
+            lambda t: run_thread(process_index * threads + t, user_ids, messages, fresh), range(threads)
+        ))
+
+
+def create_users(count, threads):
+    # No user_id given, so the backend generates them concurrently
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(
+            lambda i: api_client.clone().create_user(f"Stress {i}", "Undergraduate"), range(count)
+        ))
+    return [result.get("user_id") for result in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=25, help="messages per thread")
+    parser.add_argument("--users", type=int, default=5, help="few users means heavy contention per user")
+    parser.add_argument("--fresh", action="store_true", help="bypass the response cache (calls the model)")
+    args = parser.parse_args()
+
+    user_ids = create_users(args.users, args.threads)
+    problems = []
+    if None in user_ids or len(set(user_ids)) != len(user_ids):
+        problems.append(f"user ids missing or colliding: {user_ids}")
+        user_ids = [user_id for user_id in user_ids if user_id]
+
+    start = time.perf_counter()
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.processes) as pool:
+        per_process = pool.starmap(
+            run_process,
+            [(p, args.threads, user_ids, args.messages, args.fresh) for p in range(args.processes)]
+        )
+    elapsed = time.perf_counter() - start
+
+    expected = Counter()
+    sessions = {}
+    failures = 0
+    for results in per_process:
+        for session_id, counts, thread_failures in results:
+            expected.update(counts)
+            sessions[session_id] = sum(counts.values())
+            failures += thread_failures
+    if failures:
+        problems.append(f"{failures} requests failed")
+
+    # Every answered message must show up once in progress and twice in its session
+    for user_id in user_ids:
+        progress = api_client.clone()
+        progress.user_id = user_id
+        report = progress.get_progress()
+        want = sum(n for (uid, _), n in expected.items() if uid == user_id)
+        if report.get("total_interactions") != want:
+            problems.append(f"{user_id}: {report.get('total_interactions')} interactions, expected {want}")
+        for (uid, subject), n in expected.items():
+            if uid == user_id and report.get("subject_progress", {}).get(subject) != min(100, n * 5):
+                problems.append(f"{user_id}/{subject}: progress {report.get('subject_progress')} after {n} messages")
+
+    for session_id, answered in sessions.items():
+        history = api_client.clone()
+        history.session_id = session_id
+        messages = history.get_chat_history().get("messages", [])
+        if len(messages) != 2 * answered:
+            problems.append(f"{session_id}: {len(messages)} messages, expected {2 * answered}")
+        seqs = [m["seq"] for m in messages]
+        if seqs != sorted(set(seqs)):
+            problems.append(f"{session_id}: seqs out of order or repeated")
+
+    total = sum(expected.values())
+    print(json.dumps({
+        "processes": args.processes,
+        "threads": args.threads,
+        "users": len(user_ids),
+        "messages": total,
+        "failures": failures,
+        "seconds": round(elapsed, 2),
+        "messages_per_second": round(total / elapsed, 1) if elapsed else None,
+        "problems": problems[:20],
+        "ok": not problems
+    }, indent=2))
+    return 0 if not problems else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
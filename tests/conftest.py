@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read when backend is imported: no real key, no rate limits, spill files outside the tree
+os.environ.setdefault("COHERE_API_KEY", "fake")
+os.environ.setdefault("RATE_LIMIT_USER_PER_MIN", "0")
+os.environ.setdefault("RATE_LIMIT_GLOBAL_PER_SEC", "0")
+os.environ.setdefault("TUTOR_SPILL_DIR", tempfile.mkdtemp(prefix="tutor_spill_"))
+
+
+@pytest.fixture
+def fake_cohere():
+    """fake_cohere.py on a free port, answering without delay"""
+    from fake_cohere import Distribution, FakeCohereConfig, start_server
+
+    server = start_server(FakeCohereConfig(
+        latency=Distribution("fixed:0"),
+        token_latency=Distribution("fixed:0"),
+        tokens=Distribution("fixed:20"),
+        classify_latency=Distribution("fixed:0"),
+        seed=1
+    ))
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pytest
+import requests
+
+from api_client import StreamInterrupted, TutorAPIClient
+from chat_jobs import DONE, FAILED_RESPONSE, ChatJobQueue
+
+
+class ScriptedClient:
+    """stream_message fails as told; send_message counts resubmissions"""
+
+    def __init__(self, fail_after_tokens):
+        self.fail_after_tokens = fail_after_tokens
+        self.sent = []
+
+    def stream_message(self, question, subject, topic=""):
+        if self.fail_after_tokens is None:
+            # Connection refused: nothing reached the backend
+            raise requests.ConnectionError("refused")
+        yield from ({"token": f"t{i} "} for i in range(self.fail_after_tokens))
+        raise StreamInterrupted("connection reset")
+
+    def send_message(self, question, subject, topic=""):
+        self.sent.append(question)
+        return {"response": "blocking answer", "question_seq": 1, "seq": 2}
+
+
+def run_job(client):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        queue = ChatJobQueue(client, executor)
+        job = queue.submit("What is a vector?", "Physics", "Mechanics")
+    deadline = time.time() + 5
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+def test_stream_failing_before_headers_falls_back_to_send_message():
+    client = ScriptedClient(fail_after_tokens=None)
+    job = run_job(client)
+    assert job.status == DONE
+    assert job.response == "blocking answer"
+    assert (job.question_seq, job.response_seq) == (1, 2)
+    assert client.sent == ["What is a vector?"]
+
+
+def test_interrupted_stream_is_not_resubmitted():
+    client = ScriptedClient(fail_after_tokens=0)
+    job = run_job(client)
+    assert job.response == FAILED_RESPONSE
+    assert client.sent == []
+
+
+def test_interrupted_stream_keeps_its_partial_answer():
+    client = ScriptedClient(fail_after_tokens=2)
+    job = run_job(client)
+    assert job.response == "t0 t1 "
+    assert client.sent == []
+
+
+class BrokenStreamTransport:
+    @contextmanager
+    def stream(self, request, timeout=None):
+        def events():
+            yield {"token": "Hello"}
+            raise requests.exceptions.ChunkedEncodingError("connection reset")
+        yield 200, events()
+
+
+def test_client_reports_streams_broken_after_headers():
+    client = TutorAPIClient(transport=BrokenStreamTransport())
+    events = client.stream_message("Hi", "Physics")
+    assert next(events) == {"token": "Hello"}
+    with pytest.raises(StreamInterrupted):
+        next(events)
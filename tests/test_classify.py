@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import cohere
+import pytest
+
+import backend
+
+
+@pytest.fixture
+def remote_classify(fake_cohere, monkeypatch):
+    # The real SDK client, pointed at the fake server
+    monkeypatch.setattr(backend, "co", cohere.Client("fake", api_url=fake_cohere.url))
+    return fake_cohere
+
+
+def test_classify_remote_sends_examples_the_sdk_accepts(remote_classify):
+    labels = backend.classify_remote([
+        "Give me an example of Newton's second law",
+        "What is the definition of a derivative?"
+    ])
+    assert labels == ["example", "definition"]
+    assert remote_classify.calls["classify"] == 1
+
+
+def test_ambiguous_messages_are_classified_in_batches(remote_classify, monkeypatch):
+    # Nothing is confident enough locally, so every message goes to the batcher
+    monkeypatch.setattr(backend.question_classifier, "threshold", 2.0)
+    messages = [example["text"] for example in backend.CLASSIFY_EXAMPLES] * 4
+    before = backend.classify_batcher.stats()
+
+    with ThreadPoolExecutor(max_workers=len(messages)) as pool:
+        labels = list(pool.map(backend.classify_question, messages))
+
+    assert labels == [example["label"] for example in backend.CLASSIFY_EXAMPLES] * 4
+    after = backend.classify_batcher.stats()
+    assert after["items"] - before["items"] == len(messages)
+    assert after["errors"] == before["errors"]
+    assert 1 <= remote_classify.calls["classify"] < len(messages)
+    assert backend.classify_breaker.state == "closed"
+    assert backend.upstream_health.status()["operations"]["classify"]["consecutive_failures"] == 0
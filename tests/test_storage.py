@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from spill import SegmentSpill
+from storage import MemoryStore, SQLiteStore, empty_aggregates, summarize_progress
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'sqlite-write-through'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        store = MemoryStore(max_messages=8, spill=SegmentSpill(str(tmp_path / 'spill')))
+    else:
+        store = SQLiteStore(str(tmp_path / 'tutor.db'), flush_interval=0 if request.param.endswith('through') else 0.05)
+    yield store
+    store.close()
+
+
+def test_aggregates_match_a_recompute_from_raw_progress(store):
+    topics = [('Mathematics', 'Algebra'), ('Mathematics', 'Calculus'), ('Physics', 'Mechanics')]
+    for i in range(6):
+        store.create_user(f'user_{i}', f'Student {i}', 'Undergraduate')
+
+    def interact(i):
+        subject, topic = topics[i % len(topics)]
+        store.record_interaction(f'user_{i % 6}', subject, topic)
+
+    # Concurrent writers, as under several request threads
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(interact, range(300)))
+    store.record_interaction('nobody', 'Mathematics', 'Algebra')
+
+    for i in range(6):
+        user_id = f'user_{i}'
+        assert store.get_aggregates(user_id) == summarize_progress(store.get_progress(user_id))
+    assert sum(store.get_aggregates(f'user_{i}')['interactions'] for i in range(6)) == 300
+    assert store.get_aggregates('nobody') is None
+    assert store.verify_aggregates() == []
+
+
+def test_verify_aggregates_finds_and_repairs_drift(store):
+    store.create_user('user_a', 'A', 'Beginner')
+    store.create_user('user_b', 'B', 'Beginner')
+    for _ in range(3):
+        store.record_interaction('user_a', 'Physics', 'Mechanics')
+    store.record_interaction('user_b', 'Mathematics', 'Algebra')
+    store.set_aggregates('user_a', empty_aggregates())
+
+    assert store.verify_aggregates() == ['user_a']
+    assert store.verify_aggregates(rebuild=True) == ['user_a']
+    assert store.verify_aggregates() == []
+    assert store.get_aggregates('user_a')['interactions'] == 3
+
+
+def test_history_reads_stay_ordered_while_sessions_spill(tmp_path):
+    store = MemoryStore(max_messages=8, spill=SegmentSpill(str(tmp_path)))
+    store.ensure_session('s', 'u', 'Mathematics', 'Algebra')
+    done = threading.Event()
+    bad = []
+
+    def write():
+        for i in range(2000):
+            store.append_message('s', {'role': 'user', 'content': str(i), 'timestamp': 't'})
+        done.set()
+
+    def read():
+        while not done.is_set():
+            seqs = [m['seq'] for m in store.get_session('s')['messages']]
+            if seqs != list(range(1, len(seqs) + 1)):
+                bad.append(seqs)
+
+    threads = [threading.Thread(target=write)] + [threading.Thread(target=read) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not bad
+    assert [m['seq'] for m in store.get_session('s')['messages']] == list(range(1, 2001))
+
+
+def test_append_message_returns_the_seq_history_reports(store):
+    def append(i):
+        session_id = f'session_{i % 3}'
+        store.ensure_session(session_id, 'u', 'Physics', 'Mechanics')
+        return session_id, store.append_message(session_id, {'role': 'user', 'content': str(i), 'timestamp': 't'})
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        appended = list(pool.map(append, range(60)))
+
+    for i in range(3):
+        session_id = f'session_{i}'
+        expected = sorted((seq, str(n)) for n, (sid, seq) in enumerate(appended) if sid == session_id)
+        stored = [(m['seq'], m['content']) for m in store.get_session(session_id)['messages']]
+        assert stored == expected
+
+
+def test_failed_write_behind_keeps_messages_for_the_next_flush(tmp_path):
+    path = str(tmp_path / 'tutor.db')
+    # A long interval keeps the writer thread out of the way; the test flushes itself
+    store = SQLiteStore(path, flush_interval=60)
+    try:
+        store.ensure_session('s', 'u', 'Physics', 'Mechanics')
+        seqs = [store.append_message('s', {'role': 'user', 'content': str(i), 'timestamp': 't'}) for i in range(3)]
+
+        other = sqlite3.connect(path)
+        other.execute("CREATE TRIGGER fail_insert BEFORE INSERT ON messages BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+        other.commit()
+        with pytest.raises(sqlite3.Error):
+            store.flush()
+        assert store.memory_stats()['pending_writes'] == 3
+
+        other.execute("DROP TRIGGER fail_insert")
+        other.commit()
+        other.close()
+        store.flush()
+
+        assert store.memory_stats()['pending_writes'] == 0
+        assert [(m['seq'], m['content']) for m in store.get_session('s')['messages']] == \
+            [(seq, str(i)) for i, seq in enumerate(seqs)]
+    finally:
+        store.close()
@@ -0,0 +1,132 @@
+import re
+import threading
+import types
+import uuid
+from dataclasses import replace
+
+import pytest
+from werkzeug.serving import make_server
+
+import api_models as models
+import backend
+from api_client import HTTPTransport, InProcessTransport
+
+# Headers the HTTP server adds on its own; everything else must match
+SERVER_HEADERS = {"content-type", "content-length", "date", "server", "connection"}
+# Values that differ between any two runs, whatever the transport
+VOLATILE_KEYS = {"timestamp", "created_at", "start_time", "last_interaction"}
+
+
+class EchoCohere:
+    """Deterministic stand-in for the Cohere client, so both runs get the same answers"""
+
+    def generate(self, prompt, stream=False, **kwargs):
+        text = f" Answer in {len(prompt.split())} words."
+        if stream:
+            return iter([types.SimpleNamespace(text=word) for word in re.findall(r" ?\S+", text)])
+        return types.SimpleNamespace(generations=[types.SimpleNamespace(text=text)])
+
+    def classify(self, inputs, **kwargs):
+        return types.SimpleNamespace(classifications=[
+            types.SimpleNamespace(predictions=[backend.keyword_question_type(text)]) for text in inputs
+        ])
+
+
+@pytest.fixture(scope="module")
+def server():
+    http = make_server("127.0.0.1", 0, backend.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{http.server_port}"
+    http.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def echo_cohere(monkeypatch):
+    monkeypatch.setattr(backend, "co", EchoCohere())
+
+
+def make_transport(name, server):
+    return HTTPTransport(server) if name == "http" else InProcessTransport(backend.app)
+
+
+def normalize(value, ids):
+    if isinstance(value, dict):
+        return {k: "<volatile>" if k in VOLATILE_KEYS else normalize(v, ids) for k, v in value.items()}
+    if isinstance(value, list):
+        return [normalize(item, ids) for item in value]
+    if isinstance(value, str):
+        for placeholder, real in ids.items():
+            value = value.replace(real, placeholder)
+    return value
+
+
+def observe(response, ids):
+    headers = {k.lower(): v for k, v in response.headers.items() if k.lower() not in SERVER_HEADERS}
+    body = response.json() if response.status_code != 304 else None
+    return response.status_code, normalize(body, ids), normalize(headers, ids)
+
+
+def scenario(transport):
+    """The same calls for either transport: [(name, (status, body, headers))]"""
+    ids = {"<user>": f"user_{uuid.uuid4().hex[:12]}", "<session>": models.new_session_id()}
+    user_id, session_id = ids["<user>"], ids["<session>"]
+    results = []
+
+    def send(name, request):
+        response = transport.send(request)
+        results.append((name, observe(response, ids)))
+        return response
+
+    send("create_user", models.create_user("Ada", "Undergraduate", user_id=user_id))
+    send("get_user", models.get_user(user_id))
+    send("get_missing_user", models.get_user("user_missing"))
+    subjects = send("get_subjects", models.get_subjects())
+    send("get_subjects_revalidated",
+         replace(models.get_subjects(), headers={"If-None-Match": subjects.headers["ETag"]}))
+    send("get_topics", models.get_topics("Physics"))
+    send("get_missing_topics", models.get_topics("Astrology"))
+    send("get_content", models.get_content("Mathematics", "Calculus", level="beginner"))
+    send("library_answer", models.send_message(user_id, session_id, "What is the definition of Algebra?",
+                                               "Mathematics", "Algebra", fresh=True))
+    send("generated_answer", models.send_message(user_id, session_id, "Why does factoring work?",
+                                                 "Mathematics", "Algebra", fresh=True))
+    history = send("get_chat_history", models.get_chat_history(session_id))
+    send("get_chat_history_revalidated", models.get_chat_history(session_id, etag=history.headers["ETag"]))
+    send("get_earlier_messages", models.get_earlier_messages(session_id, limit=1))
+    send("get_progress", models.get_progress(user_id))
+    send("batch", models.batch([models.get_user(user_id), models.get_topics("Physics"),
+                                models.get_progress("user_missing")]))
+
+    request = models.stream_message(user_id, session_id, "Explain derivatives step by step",
+                                    "Mathematics", "Calculus", fresh=True)
+    with transport.stream(request) as (status, events):
+        results.append(("stream_message", (status, normalize(list(events), ids))))
+    return results
+
+
+@pytest.fixture(scope="module")
+def over_http(server):
+    # The reference every transport must match, HTTP included
+    backend.co, co = EchoCohere(), backend.co
+    try:
+        return scenario(HTTPTransport(server))
+    finally:
+        backend.co = co
+
+
+def test_reference_covers_errors_and_revalidation(over_http):
+    statuses = {name: result[0] for name, result in over_http}
+    assert statuses["get_missing_user"] == 404
+    assert statuses["get_missing_topics"] == 404
+    assert statuses["get_subjects_revalidated"] == 304
+    assert statuses["get_chat_history_revalidated"] == 304
+    assert set(statuses.values()) <= {200, 304, 404}
+
+
+@pytest.mark.parametrize("transport", ["http", "inprocess"])
+def test_transport_answers_like_http(transport, server, over_http):
+    results = scenario(make_transport(transport, server))
+
+    assert [name for name, _ in results] == [name for name, _ in over_http]
+    for (name, result), (_, expected) in zip(results, over_http):
+        assert result == expected, name